@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+from collections import Counter
+
+from telegram import Bot
+from telegram.error import RetryAfter
+
+from rate_limit import BULK, retry_after_seconds
+from state import StateError
+
+log = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096  # лимит длины сообщения Telegram
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> list:
+    """Режем длинный текст по строкам; строку длиннее лимита — по символам."""
+    chunks, current = [], ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class AdminNotifier:
+    """Очередь уведомлений админу.
+
+    Одиночное событие в тихое время уходит сразу. Если сообщение уже отправлялось
+    меньше interval секунд назад, события копятся и уходят одной сводкой
+    (счётчики по предметам, ролям и классам + строки с деталями).
+
+    При нескольких воркерах с общим бэкендом отправляет только ведущий (leader=True):
+    остальные перекладывают события в общую очередь, ведущий забирает их каждые
+    poll_interval секунд, так что сводка одна на все процессы.
+    """
+
+    SHARED_QUEUE = "admin:events"
+
+    def __init__(self, chat_id: int, interval: float = 30.0, max_attempts: int = 5,
+                 backend=None, leader: bool = True, poll_interval: float = 1.0):
+        self.chat_id = chat_id
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.backend = backend
+        self.leader = leader
+        self.poll_interval = poll_interval
+        self._queue = asyncio.Queue()
+        self._bot = None
+        self._task = None
+        self._pull_task = None
+        self._last_sent = float("-inf")
+
+    def submit(self, text: str, data: dict = None):
+        self._queue.put_nowait((text, data or {}))
+
+    @property
+    def _forwarding(self) -> bool:
+        return self.backend is not None and not self.leader
+
+    async def start(self, bot: Bot):
+        self._bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._forward() if self._forwarding else self._run())
+        if self.backend is not None and self.leader and self._pull_task is None:
+            self._pull_task = asyncio.create_task(self._pull())
+
+    async def stop(self):
+        for task in (self._pull_task, self._task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._pull_task = None
+        if self.backend is not None and self.leader:
+            await self._pull_once()
+        batch = self._drain([])
+        if not batch:
+            return
+        if self._forwarding:
+            await self._push(batch)
+        elif self._bot is not None:
+            await self._send(self._render(batch))
+
+    def _drain(self, batch: list) -> list:
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            wait = self._last_sent + self.interval - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._drain(batch)
+            await self._send(self._render(batch))
+            self._last_sent = loop.time()
+
+    async def _push(self, batch: list):
+        try:
+            await self.backend.push(self.SHARED_QUEUE, *(json.dumps(item, ensure_ascii=False) for item in batch))
+        except StateError as e:
+            # общая очередь недоступна — не теряем события, шлём сами
+            log.warning("Общая очередь недоступна, отправляем админу напрямую", extra={"error": str(e)})
+            await self._send(self._render(batch))
+
+    async def _forward(self):
+        while True:
+            batch = self._drain([await self._queue.get()])
+            await self._push(batch)
+
+    async def _pull_once(self):
+        try:
+            items = await self.backend.pop(self.SHARED_QUEUE)
+        except StateError as e:
+            log.warning("Общая очередь уведомлений недоступна", extra={"error": str(e)})
+            return
+        for raw in items:
+            text, data = json.loads(raw)
+            self._queue.put_nowait((text, data))
+
+    async def _pull(self):
+        while True:
+            await self._pull_once()
+            await asyncio.sleep(self.poll_interval)
+
+    def _render(self, batch: list) -> str:
+        if len(batch) == 1:
+            return batch[0][0]
+        rows = [data for _, data in batch]
+        lines = [f"📊 Сводка: {len(batch)} заявок/запросов"]
+        for title, key in (("📘 Предметы", "subject"), ("🎓 Роли", "role"), ("🧑‍🎓 Классы", "class")):
+            counts = Counter(row.get(key, "-") for row in rows)
+            lines.append(f"{title}: " + ", ".join(f"{name} — {n}" for name, n in counts.most_common()))
+        lines.append("")
+        for text, data in batch:
+            if data:
+                lines.append(
+                    f"{data.get('time', '-')} | {data.get('role', '-')}/{data.get('action', '-')} | "
+                    f"{data.get('subject', '-')} | {data.get('class', '-')} | {data.get('nickname', '-')} | "
+                    f"{data.get('phone', '-')} | {data.get('user_id', '-')}"
+                )
+            else:
+                lines.append(text.replace("\n", " | "))
+        return "\n".join(lines)
+
+    async def _send(self, text: str):
+        for chunk in split_message(text):
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    await self._bot.send_message(chat_id=self.chat_id, text=chunk,
+                                                 rate_limit_args={"priority": BULK})
+                    break
+                except RetryAfter as e:
+                    await asyncio.sleep(retry_after_seconds(e))
+                except Exception as e:
+                    log.warning("Ошибка отправки админу", extra={"attempt": attempt, "error": str(e)})
+                    await asyncio.sleep(min(2 ** attempt, 30))
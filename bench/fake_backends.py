@@ -0,0 +1,233 @@
+"""Локальные заглушки внешних сервисов для нагрузочных тестов: Bot API и Google Sheets."""
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+from keep_alive import Request, WebServer
+
+FAKE_BOT = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": True}
+
+MULTIPART_FIELD = re.compile(rb'name="([^"]+)"\r\n(?:[^\r\n]*\r\n)*\r\n(.*?)\r\n--', re.S)
+
+
+def parse_params(request: Request) -> dict:
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        return {
+            name.decode(): value.decode("utf-8", "replace")
+            for name, value in MULTIPART_FIELD.findall(request.body)
+            if b"\x00" not in value[:64]
+        }
+    if content_type.startswith("application/json"):
+        return json.loads(request.body or b"{}")
+    return {k: v[0] for k, v in parse_qs(request.body.decode("utf-8")).items()}
+
+
+class FakeBotApi(WebServer):
+    """Фейковый Bot API: отвечает правдоподобными объектами, считает вызовы по методам.
+
+    latency — средняя задержка ответа (сек), error_rate — доля ответов 500,
+    flood_rate — доля ответов 429 с retry_after.
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, flood_rate: float = 0.0, member_status: str = "member"):
+        super().__init__(host="127.0.0.1", port=port, max_connections=10_000)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.flood_rate = flood_rate
+        self.member_status = member_status
+        self.calls = Counter()
+        self.errors = Counter()
+        self._message_ids = itertools.count(1000)
+        self._file_ids = itertools.count(1)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _dispatch(self, request: Request):
+        method = request.path.rsplit("/", 1)[-1]
+        self.calls[method] += 1
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        roll = random.random()
+        if roll < self.flood_rate:
+            self.errors[f"{method}:429"] += 1
+            return self._json(429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                    "parameters": {"retry_after": 1}})
+        if roll < self.flood_rate + self.error_rate:
+            self.errors[f"{method}:500"] += 1
+            return self._json(500, {"ok": False, "error_code": 500, "description": "Internal Server Error: injected"})
+        params = parse_params(request)
+        return self._json(200, {"ok": True, "result": self._result(method, params)})
+
+    @staticmethod
+    def _json(status: int, payload: dict):
+        return status, json.dumps(payload, ensure_ascii=False), "application/json"
+
+    def _message(self, chat_id, **extra) -> dict:
+        chat_id = int(chat_id) if str(chat_id).lstrip("-").isdigit() else 1
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "from": FAKE_BOT, **extra}
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return FAKE_BOT
+        if method == "getChatMember":
+            user_id = int(params.get("user_id", 0))
+            return {"status": self.member_status,
+                    "user": {"id": user_id, "is_bot": False, "first_name": "User"}}
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(params.get("chat_id"), text=params.get("text", ""))
+        if method == "sendDocument":
+            document = params.get("document", "")
+            file_id = document if document and not document.startswith("attach://") else f"FILE{next(self._file_ids)}"
+            return self._message(params.get("chat_id"),
+                                 document={"file_id": file_id, "file_unique_id": f"U{file_id}"})
+        return True
+
+
+class FakeSheetsClient:
+    """Заглушка SheetsClient с задержкой и ошибками; вызывается из потока, как настоящий."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rows = 0
+        self.calls = 0
+        self.errors = 0
+
+    def worksheet(self):
+        return self
+
+    def append_rows(self, rows: list):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self.errors += 1
+            raise RuntimeError("injected Sheets error")
+        self.rows += len(rows)
+
+    def invalidate(self):
+        pass
+
+
+class FakeRedis:
+    """Локальная замена Redis для проверки RedisBackend: протокол RESP2, данные в памяти.
+
+    Поддерживает ровно те команды, которыми пользуется state.RedisBackend.
+    state здесь не импортируется: его бэкенд создаётся при импорте, а нагрузочный тест
+    выставляет STATE_BACKEND уже после запуска этой заглушки.
+    """
+
+    def __init__(self, port: int = 0):
+        self.port = port
+        self.values = {}  # ключ -> (значение, истекает_в | None)
+        self.lists = {}
+        self.commands = Counter()
+        self._server = None
+        self._clients = {}  # задача обработчика -> writer
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.port}/0"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # обработчики соединений дожидаемся сами: в 3.11 wait_closed их не ждёт,
+            # а отменённые при выходе из asyncio.run задачи засоряют вывод ошибками
+            for writer in self._clients.values():
+                writer.close()
+            await asyncio.gather(*list(self._clients), return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    @staticmethod
+    async def _read_command(reader: asyncio.StreamReader) -> list:
+        header = await reader.readline()
+        if not header:
+            return None
+        args = []
+        for _ in range(int(header[1:-2])):
+            size = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(size + 2))[:-2].decode("utf-8"))
+        return args
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, bool):
+            return b"+OK\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(FakeRedis._encode(v) for v in value)
+        data = value.encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def _execute(self, args: list):
+        name, args = args[0].upper(), args[1:]
+        self.commands[name] += 1
+        if name == "PING":
+            return b"+PONG\r\n"
+        if name in ("AUTH", "SELECT"):
+            return True
+        if name == "GET":
+            entry = self.values.get(args[0])
+            if entry and entry[1] is not None and entry[1] <= time.monotonic():
+                del self.values[args[0]]
+                entry = None
+            return entry[0] if entry else None
+        if name == "SET":
+            ttl = int(args[3]) / 1000 if len(args) > 3 and args[2].upper() == "PX" else None
+            self.values[args[0]] = (args[1], time.monotonic() + ttl if ttl else None)
+            return True
+        if name == "DEL":
+            removed = sum(self.values.pop(k, None) is not None or self.lists.pop(k, None) is not None for k in args)
+            return removed
+        if name == "RPUSH":
+            self.lists.setdefault(args[0], []).extend(args[1:])
+            return len(self.lists[args[0]])
+        if name == "LPOP":
+            items = self.lists.get(args[0], [])
+            count = int(args[1]) if len(args) > 1 else 1
+            taken, self.lists[args[0]] = items[:count], items[count:]
+            return taken or None
+        return b"-ERR unknown command '%s'\r\n" % name.encode()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._clients[task] = writer
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                reply = self._execute(args)
+                writer.write(reply if isinstance(reply, bytes) else self._encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clients.pop(task, None)
+            writer.close()
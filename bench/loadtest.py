@@ -0,0 +1,282 @@
+"""Нагрузочный тест: настоящий Application и хендлеры bot.py против фейковых Bot API и Sheets.
+
+Запуск из корня репозитория:
+    python -m bench.loadtest --users 2000 --concurrency 200 --api-latency 0.03
+"""
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+from bench.fake_backends import FakeBotApi, FakeRedis, FakeSheetsClient
+
+SUBJECT_DIRS = {"math": "Математика", "physics": "Физика", "chemistry": "Химия",
+                "biology": "Биология", "russian": "Русский", "biochemistry": "Биохимия"}
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Stats:
+    """Задержки по хендлерам и счётчики одного прогона."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = 0
+        self.updates = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def record(self, handler: str, seconds: float):
+        self.latencies[handler].append(seconds)
+        self.updates += 1
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def as_dict(self, api: FakeBotApi, sheets: FakeSheetsClient) -> dict:
+        return {
+            "updates": self.updates,
+            "elapsed": round(self.elapsed, 3),
+            "updates_per_sec": round(self.updates / self.elapsed, 1) if self.elapsed else 0.0,
+            "handler_errors": self.errors,
+            "handlers": {
+                name: {
+                    "n": len(values),
+                    "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                    "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                    "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+                }
+                for name, values in sorted(self.latencies.items())
+            },
+            "outbound_calls": dict(sorted(api.calls.items())),
+            "outbound_errors": dict(sorted(api.errors.items())),
+            "sheets": {"rows": sheets.rows, "calls": sheets.calls, "errors": sheets.errors},
+        }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"Апдейтов: {report['updates']} за {report['elapsed']:.2f} с "
+        f"({report['updates_per_sec']:.1f}/с), ошибок хендлеров: {report['handler_errors']}",
+        "",
+        f"{'хендлер':<22}{'n':>7}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}",
+    ]
+    for name, h in report["handlers"].items():
+        lines.append(f"{name:<22}{h['n']:>7}{h['p50_ms']:>10.1f}{h['p95_ms']:>10.1f}{h['p99_ms']:>10.1f}")
+    lines.append("")
+    lines.append("Исходящие вызовы Bot API: " + ", ".join(f"{k}={v}" for k, v in report["outbound_calls"].items()))
+    if report["outbound_errors"]:
+        lines.append("Ошибки Bot API: " + ", ".join(f"{k}={v}" for k, v in report["outbound_errors"].items()))
+    s = report["sheets"]
+    lines.append(f"Sheets: строк={s['rows']} вызовов append_rows={s['calls']} ошибок={s['errors']}")
+    if report.get("state_commands"):
+        lines.append("Команды Redis: " + ", ".join(f"{k}={v}" for k, v in report["state_commands"].items()))
+    return "\n".join(lines)
+
+
+def prepare_env(workdir: str, real_limits: bool = False, state_backend: str = "", record: str = ""):
+    """Все файлы бота — во временную папку; фейковые материалы по каждому предмету."""
+    materials = os.path.join(workdir, "materials")
+    for folder in SUBJECT_DIRS:
+        os.makedirs(os.path.join(materials, folder), exist_ok=True)
+        with open(os.path.join(materials, folder, "guide.pdf"), "wb") as f:
+            f.write(b"%PDF-1.4\n" + os.urandom(64 * 1024))
+    os.environ.update({
+        "BOT_TOKEN": "123456:FAKE",
+        "MATERIALS_DIR": materials,
+        "SHEETS_SPOOL_FILE": os.path.join(workdir, "sheets_spool.db"),
+        "SESSIONS_FILE": os.path.join(workdir, "sessions.db"),
+        "FILE_ID_CACHE_FILE": os.path.join(workdir, "file_ids.json"),
+        "REGISTRATIONS_FILE": os.path.join(workdir, "registrations.db"),
+        "BROADCASTS_FILE": os.path.join(workdir, "broadcasts.db"),
+        "REMINDERS_FILE": os.path.join(workdir, "reminders.db"),
+        "PORT": "0",
+        "CATALOG_POLL_INTERVAL": "0",
+        "STATE_BACKEND": state_backend,
+        "RECORD_UPDATES_FILE": record,
+    })
+    # логи бота (JSON) — только предупреждения, чтобы не перемешивать с отчётом; LOG_LEVEL=INFO вернёт трассы
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if not real_limits:
+        # у фейкового API лимитов нет — меряем сам бот, а не лимитер
+        os.environ.setdefault("GLOBAL_MSG_RATE", "1000000")
+        os.environ.setdefault("CHAT_MSG_RATE", "1000000")
+
+
+class Stack:
+    """Запущенный бот + заглушки. Используется и нагрузочным тестом, и воспроизведением трафика."""
+
+    def __init__(self, api: FakeBotApi, sheets: FakeSheetsClient, real_limits: bool = False,
+                 state_backend: str = "", record: str = ""):
+        self.api = api
+        self.sheets = sheets
+        self.real_limits = real_limits
+        self.state_backend = state_backend
+        self.record = record
+        self.workdir = tempfile.TemporaryDirectory(prefix="dogbench-")
+        self.bot = None
+        self.app = None
+        self.stats = Stats()
+
+    async def __aenter__(self):
+        prepare_env(self.workdir.name, self.real_limits, self.state_backend, self.record)
+        await self.api.start()
+        self.bot = importlib.import_module("bot")
+        self.bot.sheets_writer.client = self.sheets
+        self.app = self.bot.build_app(os.environ["BOT_TOKEN"], base_url=self.api.url)
+
+        async def count_errors(update, context):
+            self.stats.errors += 1
+
+        self.app.add_error_handler(count_errors)
+        await self.app.initialize()
+        await self.bot.post_init(self.app)
+        await self.app.start()
+        self.stats = Stats()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.app.stop()
+        await self.bot.post_stop(self.app)
+        await self.app.shutdown()
+        await self.bot.post_shutdown(self.app)
+        await self.api.stop()
+        self.workdir.cleanup()
+
+    async def feed(self, handler: str, data: dict):
+        from telegram import Update
+        update = Update.de_json(data, self.app.bot)
+        started = time.perf_counter()
+        # через процессор апдейтов, как в боевом режиме (очередь пользователя, лимит параллельности)
+        await self.app.update_processor.process_update(update, self.app.process_update(update))
+        self.stats.record(handler, time.perf_counter() - started)
+
+    def report(self) -> dict:
+        self.stats.finish()
+        return self.stats.as_dict(self.api, self.sheets)
+
+
+_update_ids = itertools.count(1)
+
+
+def user_dict(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+
+def message_update(user_id: int, text: str = None, contact: dict = None) -> dict:
+    message = {"message_id": next(_update_ids), "date": int(time.time()),
+               "chat": {"id": user_id, "type": "private"}, "from": user_dict(user_id)}
+    if text is not None:
+        message["text"] = text
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    if contact is not None:
+        message["contact"] = contact
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    return {"update_id": next(_update_ids), "callback_query": {
+        "id": str(next(_update_ids)), "from": user_dict(user_id), "chat_instance": str(user_id), "data": data,
+        "message": {"message_id": next(_update_ids), "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"}, "from": {"id": 1, "is_bot": True, "first_name": "Bot"},
+                    "text": "..."},
+    }}
+
+
+def inline_update(user_id: int, query: str) -> dict:
+    return {"update_id": next(_update_ids), "inline_query": {
+        "id": str(next(_update_ids)), "from": user_dict(user_id), "query": query, "offset": ""}}
+
+
+async def simulate_user(stack: Stack, user_id: int, think: float):
+    """Полная воронка: /start → роль → действие → предмет → класс → телефон → материал → inline-поиск."""
+    action = random.choice(("register", "materials"))
+    subject = random.choice([s for s in SUBJECT_DIRS.values() if s != "Биохимия"])
+    encode = stack.bot.codec.encode
+    steps = [
+        ("start", message_update(user_id, "/start")),
+        ("choose_role", callback_update(user_id, encode("role", "student"))),
+        ("student_action", callback_update(user_id, encode("action", action))),
+        ("choose_subject", callback_update(user_id, encode("subject", subject))),
+        ("class_choice", callback_update(user_id, encode("class", random.choice(("5", "8", "OGE", "EGE"))))),
+    ]
+    if action == "register":
+        steps.append(("phone_input", message_update(user_id, contact={
+            "phone_number": f"+7900{user_id:07d}", "first_name": "User", "user_id": user_id})))
+    material = stack.bot.catalog.for_subject(subject)[0]
+    steps.append(("send_material_file", callback_update(user_id, encode("material", material.id))))
+    # уже полученный материал потом ищут через inline-режим
+    steps.append(("inline_query", inline_update(user_id, f"{subject} {material.title[:4]}")))
+    for handler, data in steps:
+        await stack.feed(handler, data)
+        if think:
+            await asyncio.sleep(random.uniform(0, 2 * think))
+
+
+async def run(args) -> dict:
+    api = FakeBotApi(latency=args.api_latency, jitter=args.api_latency / 2,
+                     error_rate=args.api_error_rate, flood_rate=args.api_flood_rate)
+    sheets = FakeSheetsClient(latency=args.sheets_latency, error_rate=args.sheets_error_rate)
+    redis = FakeRedis() if args.state_backend == "redis" else None
+    if redis is not None:
+        await redis.start()
+    state_backend = {"none": "", "memory": "memory://", "redis": redis and redis.url}[args.state_backend]
+    async with Stack(api, sheets, real_limits=args.real_limits, state_backend=state_backend,
+                     record=args.record) as stack:
+        slots = asyncio.Semaphore(args.concurrency)
+
+        async def one(user_id: int):
+            async with slots:
+                await simulate_user(stack, user_id, args.think)
+
+        await asyncio.gather(*(one(100_000 + i) for i in range(args.users)))
+        report = stack.report()
+        await stack.bot.sheets_writer.flush()
+    report["sheets"] = {"rows": sheets.rows, "calls": sheets.calls, "errors": sheets.errors}
+    if redis is not None:
+        report["state_commands"] = dict(sorted(redis.commands.items()))
+        await redis.stop()
+    return report
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест воронки бота против фейковых бэкендов")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременно активных пользователей")
+    parser.add_argument("--think", type=float, default=0.0, help="средняя пауза пользователя между шагами, с")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="задержка фейкового Bot API, с")
+    parser.add_argument("--api-error-rate", type=float, default=0.0)
+    parser.add_argument("--api-flood-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--sheets-latency", type=float, default=0.3, help="задержка append_rows, с")
+    parser.add_argument("--sheets-error-rate", type=float, default=0.0)
+    parser.add_argument("--real-limits", action="store_true", help="оставить боевые лимиты отправки")
+    parser.add_argument("--state-backend", choices=("none", "memory", "redis"), default="none",
+                        help="общее состояние: нет, в памяти или RedisBackend против локального FakeRedis")
+    parser.add_argument("--record", default="", help="записать апдейты прогона (для проверки bench.replay)")
+    parser.add_argument("--json", help="сохранить отчёт в JSON")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    report = asyncio.run(run(args))
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Воспроизведение записанного трафика (RECORD_UPDATES_FILE) против фейковых Bot API и Sheets.
+
+Запуск из корня репозитория:
+    python -m bench.replay updates.jsonl.gz --speed 10 --json new.json
+    python -m bench.replay updates.*.jsonl.gz --baseline old.json   # и сразу сравнить с другой сборкой
+    python -m bench.replay --compare old.json new.json              # сравнить два сохранённых отчёта
+
+Отчёт того же формата, что у bench.loadtest, поэтому --compare сравнивает и их.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from bench.fake_backends import FakeBotApi, FakeRedis, FakeSheetsClient
+from bench.loadtest import Stack, format_report
+from recorder import read_records
+
+# Апдейты, которые разбирает не CallbackRouter: вид апдейта -> имя хендлера в отчёте
+HANDLERS_BY_KIND = {"inline_query": "inline_query", "chat_member": "chat_member_update"}
+
+
+def update_kind(data: dict) -> str:
+    return next((key for key in data if key != "update_id"), "unknown")
+
+
+def handler_name(bot, data: dict) -> str:
+    """Имя хендлера bot.py, который обработает апдейт, — чтобы строки отчёта совпадали с нагрузочным тестом."""
+    kind = update_kind(data)
+    if kind == "message":
+        message = data["message"]
+        text = message.get("text") or ""
+        if text.startswith("/"):
+            return text.split()[0][1:].split("@")[0]
+        return "phone_input" if "contact" in message else "nickname_input"
+    if kind == "callback_query":
+        decoded = bot.codec.decode(data["callback_query"].get("data"))
+        handler = bot.callback_router.routes.get(decoded[0]) if decoded else None
+        return handler.__name__ if handler else "callback_router"
+    return HANDLERS_BY_KIND.get(kind, kind)
+
+
+def remap_materials(bot, data: dict):
+    """Кнопки материалов из боевого каталога -> материалы фейкового (ID — хэш пути, они не совпадают).
+
+    Один и тот же боевой материал всегда попадает в один фейковый: повторы и кэш file_id сохраняются.
+    """
+    query = data.get("callback_query")
+    decoded = bot.codec.decode(query.get("data")) if query else None
+    if not decoded or decoded[0] != "material" or bot.catalog.get(decoded[1]) is not None:
+        return
+    materials = sorted(bot.catalog.all(), key=lambda m: m.id)
+    if materials:
+        material = materials[int(decoded[1], 16) % len(materials)]
+        query["data"] = bot.codec.encode("material", material.id)
+
+
+async def replay(stack: Stack, records: list, speed: float):
+    """Подаёт апдейты с исходными интервалами, ускоренными в speed раз (0 — без пауз)."""
+    if not records:
+        return
+    first = records[0][0]
+    started = time.perf_counter()
+    tasks = []
+    for ts, data in records:
+        if speed > 0:
+            delay = (ts - first) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        remap_materials(stack.bot, data)
+        # по задаче на апдейт: апдейты одного пользователя всё равно встанут в его очередь в исходном порядке
+        tasks.append(asyncio.create_task(stack.feed(handler_name(stack.bot, data), data)))
+    await asyncio.gather(*tasks)
+
+
+async def run(args) -> dict:
+    records = read_records(args.log)
+    if args.limit:
+        records = records[:args.limit]
+    api = FakeBotApi(latency=args.api_latency, jitter=args.api_latency / 2)
+    sheets = FakeSheetsClient(latency=args.sheets_latency)
+    redis = FakeRedis() if args.state_backend == "redis" else None
+    if redis is not None:
+        await redis.start()
+    state_backend = {"none": "", "memory": "memory://", "redis": redis and redis.url}[args.state_backend]
+    async with Stack(api, sheets, real_limits=args.real_limits, state_backend=state_backend) as stack:
+        await replay(stack, records, args.speed)
+        report = stack.report()
+        await stack.bot.sheets_writer.flush()
+    report["sheets"] = {"rows": sheets.rows, "calls": sheets.calls, "errors": sheets.errors}
+    report["replay"] = {"log": args.log, "records": len(records), "speed": args.speed,
+                        "recorded_seconds": round(records[-1][0] - records[0][0], 3) if records else 0.0}
+    if redis is not None:
+        report["state_commands"] = dict(sorted(redis.commands.items()))
+        await redis.stop()
+    return report
+
+
+def _delta(old: float, new: float) -> str:
+    if not old:
+        return "—" if not new else "новое"
+    return f"{(new - old) / old * 100:+.0f}%"
+
+
+def compare(base: dict, new: dict) -> str:
+    """Таблица «было → стало» по задержкам хендлеров и исходящим вызовам двух отчётов."""
+    lines = [
+        f"Апдейтов: {base['updates']} → {new['updates']}, "
+        f"ошибок хендлеров: {base['handler_errors']} → {new['handler_errors']}",
+        "",
+        f"{'хендлер':<22}{'p50, мс':>16}{'Δ':>7}{'p95, мс':>16}{'Δ':>7}{'p99, мс':>16}{'Δ':>7}",
+    ]
+    empty = {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    for name in sorted(set(base["handlers"]) | set(new["handlers"])):
+        old, cur = base["handlers"].get(name, empty), new["handlers"].get(name, empty)
+        row = f"{name:<22}"
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            row += f"{old[key]:>7.1f} → {cur[key]:>6.1f}{_delta(old[key], cur[key]):>7}"
+        lines.append(row)
+    lines += ["", f"{'вызов Bot API':<26}{'было':>8}{'стало':>8}{'Δ':>8}"]
+    for method in sorted(set(base["outbound_calls"]) | set(new["outbound_calls"])):
+        old, cur = base["outbound_calls"].get(method, 0), new["outbound_calls"].get(method, 0)
+        lines.append(f"{method:<26}{old:>8}{cur:>8}{_delta(old, cur):>8}")
+    old, cur = base["sheets"]["calls"], new["sheets"]["calls"]
+    lines.append(f"{'Sheets append_rows':<26}{old:>8}{cur:>8}{_delta(old, cur):>8}")
+    return "\n".join(lines)
+
+
+def load_report(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов против фейковых бэкендов")
+    parser.add_argument("log", nargs="*", help="файлы записи (.jsonl или .jsonl.gz), например по одному на воркер")
+    parser.add_argument("--speed", type=float, default=1.0, help="ускорение относительно записи; 0 — без пауз")
+    parser.add_argument("--limit", type=int, default=0, help="воспроизвести только первые N апдейтов")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="задержка фейкового Bot API, с")
+    parser.add_argument("--sheets-latency", type=float, default=0.3, help="задержка append_rows, с")
+    parser.add_argument("--real-limits", action="store_true", help="оставить боевые лимиты отправки")
+    parser.add_argument("--state-backend", choices=("none", "memory", "redis"), default="none")
+    parser.add_argument("--json", help="сохранить отчёт в JSON")
+    parser.add_argument("--baseline", help="отчёт другой сборки (JSON) для сравнения с этим прогоном")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="только сравнить два отчёта")
+    return parser
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.compare:
+        print(compare(load_report(args.compare[0]), load_report(args.compare[1])))
+        return
+    if not args.log:
+        parser.error("нужен хотя бы один файл записи")
+    report = asyncio.run(run(args))
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        print()
+        print(compare(load_report(args.baseline), report))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,65 @@
+from startup import startup_timer  # первым: от его импорта считается время запуска
 import os
+import json
+import time
+import logging
+import signal
+import tempfile
 import asyncio
 from functools import wraps
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup,
-    ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InputFile
+    ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove,
+    InlineQueryResultCachedDocument, InlineQueryResultsButton
 )
+from telegram.error import TelegramError
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, CallbackQueryHandler,
-    MessageHandler, ContextTypes, filters
+    Application, ApplicationBuilder, CommandHandler, CallbackQueryHandler,
+    ChatMemberHandler, InlineQueryHandler, MessageHandler, ContextTypes, filters
 )
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import datetime
 import pytz  # нужно установить: pip install pytz
 
+from admin_notify import AdminNotifier
+from broadcast import BroadcastEngine
+from callbacks import CallbackRouter, codec
+from catalog import catalog
+from dispatch import PerUserUpdateProcessor
+from membership import MembershipCache
+from metrics import Histogram, LoopLagMonitor, Registry
+from keep_alive import WebServer
+from rate_limit import BotRateLimiter
+from recorder import UpdateRecorder
+from registrations import RegistrationStore
+from reminders import ReminderScheduler
+from sessions import users_data  # служебное состояние пользователей (LRU + TTL + SQLite)
+from sheets import SheetsClient, SheetsSpool, SheetsWriter, worker_spools
+from state import state_backend
+from timings import HandlerTimings
+from tracing import setup_logging, tracer
+from uploads import FileTooLarge, upload_pool
+
 # ================== НАСТРОЙКИ ==================
 
+# Логи — JSON-строки через очередь (см. tracing.py). Трассы апдейтов пишутся для доли
+# TRACE_SAMPLE_RATE, а также все упавшие и медленнее TRACE_SLOW_MS
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FILE = os.getenv("LOG_FILE", "")  # пусто — stdout
+setup_logging(LOG_LEVEL, LOG_FILE)
+log = logging.getLogger("bot")
+
 # Админ
 ADMIN_ID = 7972251746  # int
 ADMIN_USERNAME = "@dogwarts_admin"
+# Не чаще одного сообщения админу в N секунд, остальное — сводкой (0 — слать каждое сразу)
+ADMIN_DIGEST_INTERVAL = float(os.getenv("ADMIN_DIGEST_INTERVAL", "30"))
 
 # Google Sheets
 GOOGLE_SHEET_NAME = "DogMathism"
 CREDENTIALS_FILE = "credentials.json"
+SHEETS_SPOOL_FILE = os.getenv("SHEETS_SPOOL_FILE", "sheets_spool.db")  # локальный спул строк
+SHEETS_BATCH_SIZE = int(os.getenv("SHEETS_BATCH_SIZE", "50"))
+SHEETS_FLUSH_INTERVAL = float(os.getenv("SHEETS_FLUSH_INTERVAL", "2.0"))  # сек
 
 # Каналы по предметам
 CHANNELS_BY_SUBJECT = {
@@ -34,95 +71,203 @@ CHANNELS_BY_SUBJECT = {
     "Биохимия": "@DogBioChemik",
 }
 
-# Материалы (название, путь к файлу)
-materials_files = {
-    "Математика": [("Свойства окружности.pdf", "materials/math/Circle.pdf"),
-                   ("Гайд векторы.pdf", "materials/math/Vectors.pdf")],
-    "Физика": [("Основы механики.pdf", "materials/physics_mechanics.pdf")],
-    "Химия": [("Таблица Менделеева.pdf", "materials/chem_periodic_table.pdf")],
-    "Биология": [("Клеточная биология.pdf", "materials/bio_cell_biology.pdf")],
-    "Русский": [("Правила орфографии.pdf", "materials/rus_orthography_rules.pdf")],
-    "Биохимия": [("Основы биохимии.pdf", "materials/biochem_basics.pdf")],
-}
+# Кэш подписок: сколько секунд верим ответу «подписан» / «не подписан»
+MEMBERSHIP_POSITIVE_TTL = float(os.getenv("MEMBERSHIP_POSITIVE_TTL", "600"))
+MEMBERSHIP_NEGATIVE_TTL = float(os.getenv("MEMBERSHIP_NEGATIVE_TTL", "15"))
+
+# Материалы берутся из каталога materials/<предмет>/ (см. catalog.py)
+CATALOG_POLL_INTERVAL = float(os.getenv("CATALOG_POLL_INTERVAL", "30"))  # сек, 0 — без опроса
+
+# Режим работы: "polling" (по умолчанию) или "webhook". HTTP-сервер (health, вебхук)
+# работает в обоих режимах на одном порту в том же event loop
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Несколько воркеров (только webhook): процесс-роутер принимает вебхук на PORT и раздаёт
+# апдейты воркерам на PORT+1..PORT+N по id пользователя. Сессии и кэши воркеры делят
+# через STATE_BACKEND (см. state.py), например redis://127.0.0.1:6379/0
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1")) if BOT_MODE == "webhook" else 1
+WORKER_INDEX = os.getenv("WORKER_INDEX", "")  # выставляет роутер дочерним процессам
+IS_LEADER = WORKER_INDEX in ("", "0")  # ведущий воркер: уведомления админу, рассылки, прогрев
+
+# Локальные базы: копия заявок и прогресс рассылок
+REGISTRATIONS_FILE = os.getenv("REGISTRATIONS_FILE", "registrations.db")
+BROADCASTS_FILE = os.getenv("BROADCASTS_FILE", "broadcasts.db")
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+
+# Напоминания о занятиях записавшимся
+REMINDERS_FILE = os.getenv("REMINDERS_FILE", "reminders.db")
+REMINDER_LEAD_MINUTES = float(os.getenv("REMINDER_LEAD_MINUTES", "60"))  # за сколько до начала
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "30"))
+
+# Лимиты исходящих сообщений Telegram (в секунду): на весь бот и на один чат
+GLOBAL_MSG_RATE = float(os.getenv("GLOBAL_MSG_RATE", "30"))
+CHAT_MSG_RATE = float(os.getenv("CHAT_MSG_RATE", "1"))
+
+# Сколько апдейтов обрабатывать параллельно (апдейты одного пользователя — всегда по очереди)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+DUPLICATE_TAP_WINDOW = float(os.getenv("DUPLICATE_TAP_WINDOW", "1.0"))  # сек
+
+# Прогрев Sheets/каталога/часового пояса в фоне сразу после старта
+WARMUP = os.getenv("WARMUP", "1") == "1"
+
+# Кэш file_id загруженных материалов и служебный чат для прогрева (пусто — без прогрева)
+MATERIALS_STORAGE_CHAT_ID = os.getenv("MATERIALS_STORAGE_CHAT_ID", "")
+
+# Режим UX: "fast" — без искусственных пауз и фейкового прогресс-бара,
+# "classic" — старое поведение (паузы + анимация), оставлено для сравнения замеров
+UX_MODE = os.getenv("UX_MODE", "fast")
+PROGRESS_THRESHOLD = float(os.getenv("PROGRESS_THRESHOLD", "1.5"))  # сек до показа «Готовлю материал…»
+CHAT_ACTION_INTERVAL = 4.5  # статус «отправляет файл» в Telegram гаснет через ~5 с
+
+# Inline-поиск материалов (@бот <запрос>); режим включается у @BotFather командой /setinline
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))  # сек, ответ персональный (подписки)
+INLINE_RESULTS_LIMIT = 20
+
+# Метрики Prometheus (/metrics) и готовность (/ready) на том же HTTP-сервере.
+# /ready отвечает 503, если превышен любой из порогов
+READY_MAX_LOOP_LAG = float(os.getenv("READY_MAX_LOOP_LAG", "1.0"))  # сек, максимум за последнюю минуту
+READY_MAX_SHEETS_BACKLOG = int(os.getenv("READY_MAX_SHEETS_BACKLOG", "500"))  # строк в спуле Sheets
+READY_MAX_UPDATE_BACKLOG = int(os.getenv("READY_MAX_UPDATE_BACKLOG", "1000"))  # апдейтов в очереди и в работе
+
+# Запись входящих апдейтов для воспроизведения (python -m bench.replay); пусто — не пишем
+RECORD_UPDATES_FILE = os.getenv("RECORD_UPDATES_FILE", "")  # .jsonl или .jsonl.gz
+RECORD_SALT = os.getenv("RECORD_SALT", "")  # соль хэшей id и телефонов; пусто — своя на каждый запуск
+
+# Фоновая запись в Google Sheets (клиент и спул создаются один раз на процесс)
+sheets_writer = SheetsWriter(
+    SheetsClient(CREDENTIALS_FILE, GOOGLE_SHEET_NAME),
+    SheetsSpool(SHEETS_SPOOL_FILE),
+    batch_size=SHEETS_BATCH_SIZE,
+    flush_interval=SHEETS_FLUSH_INTERVAL,
+)
+orphan_sheets_writers = []  # спулы без своего процесса, см. start_orphan_sheets_writers
+
+handler_timings = HandlerTimings()
+handler_seconds = Histogram("bot_handler_seconds", "Время обработки апдейта хендлером", ("handler",))
+loop_monitor = LoopLagMonitor()
+
+registrations = RegistrationStore(REGISTRATIONS_FILE)
+
+broadcasts = BroadcastEngine(BROADCASTS_FILE, workers=BROADCAST_WORKERS)
+
+reminders = ReminderScheduler(REMINDERS_FILE, lead=REMINDER_LEAD_MINUTES * 60, batch_size=REMINDER_BATCH_SIZE)
 
-# Служебное состояние пользователей
-users_data = {}
+# Общий лимит Telegram — на весь бот, поэтому делим его между воркерами;
+# лимит на чат не делим: чат пользователя обслуживает один воркер
+rate_limiter = BotRateLimiter(global_rate=GLOBAL_MSG_RATE / BOT_WORKERS, chat_rate=CHAT_MSG_RATE)
+
+admin_notifier = AdminNotifier(ADMIN_ID, interval=ADMIN_DIGEST_INTERVAL, backend=state_backend, leader=IS_LEADER)
+
+update_recorder = UpdateRecorder(RECORD_UPDATES_FILE, RECORD_SALT) if RECORD_UPDATES_FILE else None
+
+# Фоновые задачи процесса (ссылки держим, чтобы задачи не собрал GC)
+background_tasks = set()
+
+web_server = WebServer(port=PORT, max_connections=WEBHOOK_MAX_CONNECTIONS)
+
+membership_cache = MembershipCache(MEMBERSHIP_POSITIVE_TTL, MEMBERSHIP_NEGATIVE_TTL, backend=state_backend)
+
+startup_timer.mark("импорты и настройки")
 
 # ================== УТИЛИТЫ ==================
 
+def moscow_now() -> datetime.datetime:
+    return datetime.datetime.now(pytz.timezone("Europe/Moscow"))
+
+async def send_chat_action_quietly(bot, chat_id: int, action: str):
+    try:
+        await bot.send_chat_action(chat_id=chat_id, action=action)
+    except TelegramError as e:
+        # статус «печатает…» необязателен, ответ пользователю от него не зависит
+        log.debug("Не удалось отправить chat action", extra={"chat_id": chat_id, "action": action, "error": str(e)})
+
 def typing_action(func):
     @wraps(func)
     async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+        started = time.perf_counter()
+        tracer.annotate(handler=func.__name__)
         chat_id = update.effective_chat.id if update.effective_chat else None
-        if chat_id:
-            try:
-                await context.bot.send_chat_action(chat_id=chat_id, action="typing")
-            except:
-                pass
-        await asyncio.sleep(0.2)
-        return await func(update, context, *args, **kwargs)
+        if UX_MODE == "classic":
+            if chat_id:
+                await send_chat_action_quietly(context.bot, chat_id, "typing")
+            await asyncio.sleep(0.2)
+        elif chat_id:
+            # «печатает…» отправляем параллельно, не задерживая ответ
+            context.application.create_task(send_chat_action_quietly(context.bot, chat_id, "typing"))
+        try:
+            return await func(update, context, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            handler_timings.record(func.__name__, elapsed)
+            handler_seconds.observe(elapsed, handler=func.__name__)
     return wrapped
 
 def write_to_sheet(row_dict: dict):
-    """Пишем строку в Google Sheets."""
-    try:
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, scope)
-        client = gspread.authorize(creds)
-        sheet = client.open(GOOGLE_SHEET_NAME).sheet1
-        row = [
-            row_dict.get("timestamp", "-"),
-            row_dict.get("role", "-"),
-            row_dict.get("action", "-"),
-            row_dict.get("subject", "-"),
-            row_dict.get("class", "-"),
-            row_dict.get("nickname", "-"),
-            row_dict.get("phone", "-"),
-            str(row_dict.get("user_id", "-")),
-        ]
-        sheet.append_row(row)
-    except Exception as e:
-        print(f"[Sheets] Ошибка записи: {e}")
-
-async def notify_admin(context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Ставим строку в очередь на запись в Google Sheets (сама запись — в фоне пачками)."""
+    row = [
+        row_dict.get("timestamp", "-"),
+        row_dict.get("role", "-"),
+        row_dict.get("action", "-"),
+        row_dict.get("subject", "-"),
+        row_dict.get("class", "-"),
+        row_dict.get("nickname", "-"),
+        row_dict.get("phone", "-"),
+        str(row_dict.get("user_id", "-")),
+    ]
     try:
-        await context.bot.send_message(chat_id=ADMIN_ID, text=text)
-    except Exception as e:
-        print(f"[Admin] Ошибка отправки админу: {e}")
-
-def subjects_keyboard(exclude=None, only=None):
-    subjects_all = list(materials_files.keys())
-    if exclude:
-        subjects = [s for s in subjects_all if s not in exclude]
-    elif only:
-        subjects = [s for s in subjects_all if s in only]
-    else:
-        subjects = subjects_all
-    rows = [[InlineKeyboardButton(s, callback_data=f"subject|{s}")] for s in subjects]
-    return InlineKeyboardMarkup(rows)
+        sheets_writer.enqueue(row)
+    except Exception:
+        log.exception("Ошибка записи строки в спул Sheets")
 
-def class_keyboard():
-    rows = [
-        [InlineKeyboardButton("5", callback_data="class|5"),
-         InlineKeyboardButton("6", callback_data="class|6")],
-        [InlineKeyboardButton("7", callback_data="class|7"),
-         InlineKeyboardButton("8", callback_data="class|8")],
-        [InlineKeyboardButton("10", callback_data="class|10")],
-        [InlineKeyboardButton("Подготовка к ОГЭ", callback_data="class|OGE"),
-         InlineKeyboardButton("Подготовка к ЕГЭ", callback_data="class|EGE")],
-    ]
+async def notify_admin(context: ContextTypes.DEFAULT_TYPE, text: str, data: dict = None):
+    """Ставим уведомление в очередь; отправка (сразу или сводкой) — в фоне."""
+    admin_notifier.submit(text, data)
+
+# Клавиатуры собираются один раз при импорте (объекты Telegram неизменяемы)
+def subjects_keyboard(exclude=()):
+    rows = [[InlineKeyboardButton(s, callback_data=codec.encode("subject", s))]
+            for s in CHANNELS_BY_SUBJECT if s not in exclude]
     return InlineKeyboardMarkup(rows)
 
+def class_button(text: str, choice: str) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text, callback_data=codec.encode("class", choice))
+
+ROLE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Ученик", callback_data=codec.encode("role", "student"))],
+    [InlineKeyboardButton("Родитель", callback_data=codec.encode("role", "parent"))],
+    [InlineKeyboardButton("Студент ВУЗа", callback_data=codec.encode("role", "university"))],
+    [InlineKeyboardButton("Преподаватель", callback_data=codec.encode("role", "teacher"))],
+])
+
+STUDENT_ACTION_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Запись на занятия", callback_data=codec.encode("action", "register"))],
+    [InlineKeyboardButton("Получить полезные материалы", callback_data=codec.encode("action", "materials"))],
+])
+
+ALL_SUBJECTS_KEYBOARD = subjects_keyboard()
+REGISTER_SUBJECTS_KEYBOARD = subjects_keyboard(exclude=("Биохимия",))
+
+CLASS_KEYBOARD = InlineKeyboardMarkup([
+    [class_button("5", "5"), class_button("6", "6")],
+    [class_button("7", "7"), class_button("8", "8")],
+    [class_button("10", "10")],
+    [class_button("Подготовка к ОГЭ", "OGE"), class_button("Подготовка к ЕГЭ", "EGE")],
+])
+
 async def check_subscription(context: ContextTypes.DEFAULT_TYPE, user_id: int, subject: str) -> bool:
     channel = CHANNELS_BY_SUBJECT.get(subject)
     if not channel:
         return True
-    try:
-        member = await context.bot.get_chat_member(chat_id=channel, user_id=user_id)
-        return member.status in ("member", "creator", "administrator")
-    except Exception as e:
-        print(f"[Subscribe] Ошибка проверки ({channel}): {e}")
-        return False
+    return await membership_cache.is_member(context.bot, channel, user_id)
+
+async def chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Telegram сам сообщает о (от)подписках в каналах, где бот админ — обновляем кэш."""
+    await membership_cache.on_chat_member(update.chat_member)
 
 async def reply(update: Update, text: str, **kwargs):
     """Удобная отправка в текущий поток (message или callback)."""
@@ -139,34 +284,46 @@ def get_username(update: Update) -> str:
         return uname
     return ""  # нет username — попросим ввести вручную
 
+# Сессии: хендлеры берут их только через эти функции. Сессия может пропасть посреди
+# сценария — истёк SESSIONS_TTL или общий бэкенд не ответил при preload, — тогда
+# просим начать заново, а не падаем на KeyError.
+def new_session(update: Update, **values):
+    """Начинает сценарий пользователя заново и возвращает его сессию."""
+    user_id = update.effective_user.id
+    users_data[user_id] = {"user_id": user_id, **values}
+    return users_data[user_id]
+
+def session_of(update: Update):
+    """Сессия пользователя апдейта или None."""
+    return users_data.get(update.effective_user.id)
+
+async def require_session(update: Update):
+    """Сессия для шага посреди сценария; если её нет — просим /start и возвращаем None."""
+    session = session_of(update)
+    if session is None:
+        await reply(update, "⌛ Сессия устарела, нажмите /start, чтобы начать заново.")
+    return session
+
 # ================== ХЕНДЛЕРЫ ==================
 
 # /start
 @typing_action
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    users_data[user_id] = {"step": "role"}  # сброс сценария
-    kb = InlineKeyboardMarkup([
-        [InlineKeyboardButton("Ученик", callback_data="role|student")],
-        [InlineKeyboardButton("Родитель", callback_data="role|parent")],
-        [InlineKeyboardButton("Студент ВУЗа", callback_data="role|university")],
-        [InlineKeyboardButton("Преподаватель", callback_data="role|teacher")],
-    ])
+    new_session(update, step="role")  # сброс сценария
     await update.message.reply_text(
         "👋 Добро пожаловать в <b>DogWarts</b> - <b>школу</b>, где знания сильнее <b>магии</b>\n\n"
         "Выберите вашу роль:",
         parse_mode="HTML",
-        reply_markup=kb
+        reply_markup=ROLE_KEYBOARD
     )
 
 # Выбор роли
 @typing_action
-async def choose_role(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def choose_role(update: Update, context: ContextTypes.DEFAULT_TYPE, role: str):
     q = update.callback_query
     await q.answer()
-    user_id = update.effective_user.id
-    role = q.data.split("|")[1]  # student / parent / university / teacher
-    users_data[user_id] = {"step": None, "role": role, "user_id": user_id}
+    # role: student / parent / university / teacher
+    session = new_session(update, role=role)
 
     if role == "teacher":
         await q.message.reply_text(f"Если вы хотите работать у нас, свяжитесь с админом: {ADMIN_USERNAME}")
@@ -175,149 +332,149 @@ async def choose_role(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if role == "university":
         # Студент ВУЗа: только биохимия, без телефона/класса
-        users_data[user_id]["action"] = "register"  # по сути запись на биохимию
-        users_data[user_id]["subject"] = "Биохимия"
-        await ensure_nickname_then_continue(update, context, need_class=False, need_phone=False)
+        session["action"] = "register"  # по сути запись на биохимию
+        session["subject"] = "Биохимия"
+        await ensure_nickname_then_continue(update, context, session, need_class=False, need_phone=False)
         return
 
     if role == "parent":
         # Только запись
-        users_data[user_id]["action"] = "register"
-        await q.message.reply_text("Выберите предмет:", reply_markup=subjects_keyboard(exclude=["Биохимия"]))
+        session["action"] = "register"
+        await q.message.reply_text("Выберите предмет:", reply_markup=REGISTER_SUBJECTS_KEYBOARD)
         return
 
     if role == "student":
         # Выбор действия
-        kb = InlineKeyboardMarkup([
-            [InlineKeyboardButton("Запись на занятия", callback_data="action|register")],
-            [InlineKeyboardButton("Получить полезные материалы", callback_data="action|materials")],
-        ])
-        await q.message.reply_text("Выберите действие:", reply_markup=kb)
+        await q.message.reply_text("Выберите действие:", reply_markup=STUDENT_ACTION_KEYBOARD)
         return
 
 # Действия ученика
 @typing_action
-async def student_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def student_action(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str):
     q = update.callback_query
     await q.answer()
-    user_id = update.effective_user.id
-    action = q.data.split("|")[1]  # register / materials
-    users_data[user_id]["action"] = action
+    session = await require_session(update)
+    if session is None:
+        return
+    # action: register / materials
+    session["action"] = action
 
     if action == "register":
-        await q.message.reply_text("Выберите предмет:", reply_markup=subjects_keyboard(exclude=["Биохимия"]))
+        await q.message.reply_text("Выберите предмет:", reply_markup=REGISTER_SUBJECTS_KEYBOARD)
     else:
-        await q.message.reply_text("Выберите предмет для материалов:", reply_markup=subjects_keyboard())
+        await q.message.reply_text("Выберите предмет для материалов:", reply_markup=ALL_SUBJECTS_KEYBOARD)
 
 # Выбор предмета
 @typing_action
-async def choose_subject(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def choose_subject(update: Update, context: ContextTypes.DEFAULT_TYPE, subject: str):
     q = update.callback_query
     await q.answer()
-    user_id = update.effective_user.id
-    subject = q.data.split("|")[1]
-    users_data[user_id]["subject"] = subject
+    session = await require_session(update)
+    if session is None:
+        return
+    session["subject"] = subject
 
-    role = users_data[user_id].get("role")
-    action = users_data[user_id].get("action")
+    role = session.get("role")
+    action = session.get("action")
 
     # Требования по сбору данных:
     # - Запись (student/parent): НИК + КЛАСС + ТЕЛЕФОН
     # - Материалы (student): НИК + КЛАСС, телефон не нужен
     if role in ("student", "parent") and action == "register":
-        await ensure_nickname_then_continue(update, context, need_class=True, need_phone=True)
+        await ensure_nickname_then_continue(update, context, session, need_class=True, need_phone=True)
     elif role == "student" and action == "materials":
-        await ensure_nickname_then_continue(update, context, need_class=True, need_phone=False)
+        await ensure_nickname_then_continue(update, context, session, need_class=True, need_phone=False)
     elif role == "university":
         # сюда обычно не попадем, но на всякий случай
-        await ensure_nickname_then_continue(update, context, need_class=False, need_phone=False)
+        await ensure_nickname_then_continue(update, context, session, need_class=False, need_phone=False)
     else:
-        await ensure_nickname_then_continue(update, context, need_class=False, need_phone=False)
+        await ensure_nickname_then_continue(update, context, session, need_class=False, need_phone=False)
 
 # --- СБОР НИКНЕЙМА / КЛАССА / ТЕЛЕФОНА ---
 
-async def ensure_nickname_then_continue(update: Update, context: ContextTypes.DEFAULT_TYPE,
+async def ensure_nickname_then_continue(update: Update, context: ContextTypes.DEFAULT_TYPE, session,
                                         need_class: bool, need_phone: bool):
-    user_id = update.effective_user.id
     # Попробуем взять username
     username = get_username(update)
     if username:
-        users_data[user_id]["nickname"] = username
+        session["nickname"] = username
         if need_class:
-            users_data[user_id]["next_need_phone"] = need_phone
+            session["next_need_phone"] = need_phone
             await ask_class(update)
         else:
             if need_phone:
-                await ask_phone(update)
+                await ask_phone(update, session)
             else:
                 await finalize_and_materials(update, context)
     else:
         # Просим никнейм текстом
-        users_data[user_id]["step"] = "nickname"
+        session["step"] = "nickname"
         await reply(update, "Введите ваш никнейм (в формате @username):")
 
 @typing_action
 async def nickname_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
     # Обрабатываем только если ждём ник
-    if users_data.get(user_id, {}).get("step") != "nickname":
+    session = session_of(update)
+    if session is None or session.get("step") != "nickname":
         return
     text = (update.message.text or "").strip()
     if not text.startswith("@") or len(text) < 2:
         await update.message.reply_text("Пожалуйста, пришлите ник в формате @username.")
         return
-    users_data[user_id]["nickname"] = text
-    users_data[user_id]["step"] = None
+    session["nickname"] = text
+    session["step"] = None
 
     # Определяем, что дальше нужно
-    role = users_data[user_id].get("role")
-    action = users_data[user_id].get("action")
+    role = session.get("role")
+    action = session.get("action")
     if role in ("student", "parent") and action == "register":
         # Нужен класс + телефон
-        users_data[user_id]["next_need_phone"] = True
+        session["next_need_phone"] = True
         await ask_class(update)
     elif role == "student" and action == "materials":
         # Нужен только класс
-        users_data[user_id]["next_need_phone"] = False
+        session["next_need_phone"] = False
         await ask_class(update)
     else:
         # Студент ВУЗа / прочее — без класса/телефона
         await finalize_and_materials(update, context)
 
 async def ask_class(update: Update):
-    await reply(update, "Выберите класс:", reply_markup=class_keyboard())
+    await reply(update, "Выберите класс:", reply_markup=CLASS_KEYBOARD)
 
 @typing_action
-async def class_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def class_choice(update: Update, context: ContextTypes.DEFAULT_TYPE, choice: str):
     q = update.callback_query
     await q.answer()
-    user_id = update.effective_user.id
-    choice = q.data.split("|")[1]  # 5/6/7/8/10/OGE/EGE
-    users_data[user_id]["class"] = choice
+    session = await require_session(update)
+    if session is None:
+        return
+    # choice: 5/6/7/8/10/OGE/EGE
+    session["class"] = choice
 
-    need_phone = users_data[user_id].pop("next_need_phone", False)
+    need_phone = session.pop("next_need_phone", False)
     if need_phone:
-        await ask_phone(update)
+        await ask_phone(update, session)
     else:
         await finalize_and_materials(update, context)
 
-async def ask_phone(update: Update):
-    users_data[update.effective_user.id]["step"] = "phone"
+async def ask_phone(update: Update, session):
+    session["step"] = "phone"
     kb = ReplyKeyboardMarkup([[KeyboardButton("📱 Отправить контакт", request_contact=True)]],
                              resize_keyboard=True, one_time_keyboard=True)
     await reply(update, "Отправьте ваш номер телефона:", reply_markup=kb)
 
 @typing_action
 async def phone_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    if users_data.get(user_id, {}).get("step") != "phone":
+    session = session_of(update)
+    if session is None or session.get("step") != "phone":
         return
     contact = update.message.contact
     if not contact:
         await update.message.reply_text("Пожалуйста, отправьте контакт кнопкой ниже.")
         return
-    users_data[user_id]["phone"] = contact.phone_number
-    users_data[user_id]["step"] = None
+    session["phone"] = contact.phone_number
+    session["step"] = None
     await update.message.reply_text("Спасибо!", reply_markup=ReplyKeyboardRemove())
     await finalize_and_materials(update, context)
 
@@ -325,21 +482,20 @@ async def phone_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def finalize_and_materials(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    data = users_data.get(user_id, {}).copy()
+    session = session_of(update)
+    data = session.copy() if session is not None else {}
     data.setdefault("subject", "-")
     data.setdefault("class", "-")
     data.setdefault("phone", "-")
     data.setdefault("role", "-")
     data.setdefault("action", "-")
-    tz = pytz.timezone("Europe/Moscow")
-    now = datetime.datetime.now(tz)
+    now = moscow_now()
     timestamp_for_sheets = now.strftime("%Y-%m-%d %H:%M:%S")  # ISO для Google Sheets
     timestamp_for_admin = now.strftime("%d.%m.%Y %H:%M")      # Красиво для сообщения
     data["timestamp"] = timestamp_for_sheets
 
 
-    # Пишем в Google Sheets
-    await asyncio.to_thread(write_to_sheet, {
+    record = {
         "timestamp": timestamp_for_sheets,
         "role": data["role"],
         "action": data["action"],
@@ -348,7 +504,21 @@ async def finalize_and_materials(update: Update, context: ContextTypes.DEFAULT_T
         "nickname": data.get("nickname", "-"),
         "phone": data.get("phone", "-"),
         "user_id": user_id
-    })
+    }
+    # Пишем в Google Sheets (через локальный спул) и в локальную базу заявок
+    write_to_sheet(record)
+    try:
+        with tracer.span("db.registrations"):
+            registrations.add(record)
+    except Exception:
+        log.exception("Ошибка записи в локальную базу заявок")
+    if data["action"] == "register":
+        # новичок получит напоминания об уже назначенных занятиях своей группы
+        try:
+            with tracer.span("db.reminders"):
+                reminders.add_user(user_id, data["subject"], data["class"])
+        except Exception:
+            log.exception("Ошибка планирования напоминаний")
 
     # Уведомление админу
     note = (
@@ -362,7 +532,16 @@ async def finalize_and_materials(update: Update, context: ContextTypes.DEFAULT_T
         f"📞 Телефон: {data.get('phone', '-')}\n"
         f"🆔 ID: {user_id}"
     )
-    await notify_admin(context, note)
+    await notify_admin(context, note, {
+        "time": timestamp_for_admin,
+        "role": data["role"],
+        "action": data["action"],
+        "subject": data["subject"],
+        "class": data["class"],
+        "nickname": data.get("nickname", "-"),
+        "phone": data.get("phone", "-"),
+        "user_id": user_id,
+    })
 
     # Проверка подписки на канал предмета — перед показом материалов
     subject = data["subject"]
@@ -384,82 +563,406 @@ async def finalize_and_materials(update: Update, context: ContextTypes.DEFAULT_T
     await return_to_role_selection(update)
 
 async def send_materials_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, subject: str):
-    files = materials_files.get(subject, [])
-    if not files:
+    kb = catalog.keyboard(subject)
+    if not kb:
         await reply(update, "📂 Для выбранного предмета пока нет материалов.")
         return
-    kb = InlineKeyboardMarkup([
-        [InlineKeyboardButton(name, callback_data=f"material|{subject}|{i}")]
-        for i, (name, _) in enumerate(files)
-    ])
     await reply(update, f"📚 Выберите материал по {subject}:", reply_markup=kb)
 
 @typing_action
-async def send_material_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def send_material_file(update: Update, context: ContextTypes.DEFAULT_TYPE, material_id: str):
     q = update.callback_query
     await q.answer()
-    try:
-        _, subject, idx_str = q.data.split("|")
-        idx = int(idx_str)
-    except Exception:
-        await q.message.reply_text("❌ Ошибка обработки запроса.")
-        return
 
-    files = materials_files.get(subject, [])
-    if idx >= len(files):
+    material = catalog.get(material_id) if material_id else None
+    if material is None:
         await q.message.reply_text("❌ Материал не найден.")
         return
 
-    filename, filepath = files[idx]
+    filename, filepath = material.title, material.path
     try:
-        progress = await q.message.reply_text("Готовлю материал… [░░░░░░░░░░] 0%")
-        total = 10
-        for step in range(1, total + 1):
-            await asyncio.sleep(0.25)
-            bar = "█" * step + "░" * (total - step)
-            await progress.edit_text(f"Готовлю материал… [{bar}] {step*10}%")
-        with open(filepath, "rb") as f:
-            await q.message.reply_document(document=InputFile(f), filename=filename)
-        try:
-            await progress.delete()
-        except:
-            pass
+        if UX_MODE == "classic":
+            await send_material_with_fake_progress(q, filepath, filename, material.size)
+        else:
+            await send_material_with_upload_status(q, filepath, filename, material.size)
+    except FileTooLarge:
+        await q.message.reply_text("❌ Файл слишком большой для Telegram (больше 50 МБ).")
     except FileNotFoundError:
         await q.message.reply_text("❌ Файл не найден на сервере.")
-    except Exception as e:
-        print(f"[Material] Ошибка: {e}")
+    except Exception:
+        log.exception("Ошибка отправки материала", extra={"material_id": material_id})
         await q.message.reply_text("❌ Произошла ошибка при подготовке материала.")
 
+@typing_action
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Поиск материалов из поля ввода: результаты — уже загруженные файлы (по file_id).
+
+    Проверка подписки та же, что в меню: материалы предметов, на каналы которых
+    пользователь не подписан, не показываются, вместо них — кнопка в бот.
+    """
+    query = update.inline_query
+    found = catalog.search(query.query, INLINE_RESULTS_LIMIT)
+    subjects = sorted({m.subject for m in found})
+    subscribed = await asyncio.gather(*(check_subscription(context, query.from_user.id, s) for s in subjects))
+    locked = {s for s, ok in zip(subjects, subscribed) if not ok}
+
+    results = []
+    for material in found:
+        if material.subject in locked:
+            continue
+        file_id = await upload_pool.file_id(material.path)
+        if file_id:
+            results.append(InlineQueryResultCachedDocument(
+                id=material.id, title=material.title, document_file_id=file_id, description=material.subject,
+            ))
+    button = None
+    if locked:
+        button = InlineQueryResultsButton("🔒 Ещё материалы — после подписки на канал", start_parameter="subscribe")
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True, button=button)
+
+async def send_material_with_upload_status(q, filepath: str, filename: str, size: int = None):
+    """Отправка без искусственных задержек.
+
+    Пока идёт настоящая загрузка, держим статус «отправляет файл»; сообщение
+    «Готовлю материал…» показываем, только если отправка дольше PROGRESS_THRESHOLD.
+    """
+    uploading = not upload_pool.is_cached(filepath)
+    send = asyncio.ensure_future(upload_pool.reply(q.message, filepath, filename, size))
+    progress = None
+    try:
+        started = time.monotonic()
+        while not send.done():
+            if uploading:
+                await send_chat_action_quietly(q.get_bot(), q.message.chat_id, "upload_document")
+            left = PROGRESS_THRESHOLD - (time.monotonic() - started)
+            timeout = CHAT_ACTION_INTERVAL if progress or left <= 0 else min(left, CHAT_ACTION_INTERVAL)
+            await asyncio.wait({send}, timeout=timeout)
+            if not send.done() and progress is None and time.monotonic() - started >= PROGRESS_THRESHOLD:
+                progress = await q.message.reply_text("Готовлю материал…")
+        return send.result()
+    finally:
+        if not send.done():
+            send.cancel()
+        if progress:
+            await delete_quietly(progress)
+
+async def send_material_with_fake_progress(q, filepath: str, filename: str, size: int = None):
+    progress = await q.message.reply_text("Готовлю материал… [░░░░░░░░░░] 0%")
+    total = 10
+    for step in range(1, total + 1):
+        await asyncio.sleep(0.25)
+        bar = "█" * step + "░" * (total - step)
+        await progress.edit_text(f"Готовлю материал… [{bar}] {step*10}%")
+    await upload_pool.reply(q.message, filepath, filename, size)
+    await delete_quietly(progress)
+
+async def delete_quietly(message):
+    """Удаляем служебное сообщение; если оно уже удалено или устарело — не страшно."""
+    try:
+        await message.delete()
+    except TelegramError as e:
+        log.debug("Не удалось удалить сообщение", extra={"message_id": message.message_id, "error": str(e)})
+
 # Возврат к выбору роли
 async def return_to_role_selection(update: Update):
-    kb = InlineKeyboardMarkup([
-        [InlineKeyboardButton("Ученик", callback_data="role|student")],
-        [InlineKeyboardButton("Родитель", callback_data="role|parent")],
-        [InlineKeyboardButton("Студент ВУЗа", callback_data="role|university")],
-        [InlineKeyboardButton("Преподаватель", callback_data="role|teacher")],
-    ])
-    await asyncio.sleep(0.6)
-    await reply(update, "Можете выбрать другой сценарий:", reply_markup=kb)
+    if UX_MODE == "classic":
+        await asyncio.sleep(0.6)
+    await reply(update, "Можете выбрать другой сценарий:", reply_markup=ROLE_KEYBOARD)
 
 # ================== MAIN ==================
 
-def main():
-    token = os.getenv("BOT_TOKEN")
-    if not token:
-        print("❌ BOT_TOKEN не задан в переменных окружения.")
+ALLOWED_UPDATES = ["message", "callback_query", "chat_member", "inline_query"]
+
+async def warm_up(app: Application):
+    """Фоновый прогрев после старта: первый пользователь не должен ждать авторизацию в Sheets."""
+    with startup_timer.phase("прогрев: Google Sheets"):
+        try:
+            await asyncio.to_thread(sheets_writer.client.worksheet)
+        except Exception as e:
+            log.warning("Прогрев Sheets не удался, подключимся при первой записи", extra={"error": str(e)})
+    with startup_timer.phase("прогрев: каталог материалов"):
+        await catalog.refresh_async()
+    log.info(startup_timer.report(),
+             extra={"phases_ms": {name: round(seconds * 1000) for name, seconds in startup_timer.phases}})
+    if MATERIALS_STORAGE_CHAT_ID and IS_LEADER:
+        # Загружаем каталог заранее, чтобы пользователи получали файлы по file_id
+        files = [(m.title, m.path) for m in catalog.all()]
+        await upload_pool.prewarm(app.bot, MATERIALS_STORAGE_CHAT_ID, files)
+
+async def start_orphan_sheets_writers():
+    """Досылает спулы Sheets, которые не ведёт ни один процесс.
+
+    Такие остаются после смены числа воркеров: sheets_spool.db после перехода на воркеров
+    (его ведёт роутер — sheets_writer в его процессе), sheets_spool.<i>.db с i >= BOT_WORKERS
+    после их уменьшения или все sheets_spool.<i>.db после возврата к одному процессу.
+    Вызывают роутер или единственный процесс, но не воркеры.
+    """
+    first = BOT_WORKERS if BOT_WORKERS > 1 else 0
+    for path in worker_spools(SHEETS_SPOOL_FILE, first):
+        spool = SheetsSpool(path)
+        log.info("Спул без воркера, досылаем", extra={"path": path, "rows": spool.count()})
+        writer = SheetsWriter(sheets_writer.client, spool, batch_size=SHEETS_BATCH_SIZE,
+                              flush_interval=SHEETS_FLUSH_INTERVAL)
+        orphan_sheets_writers.append(writer)
+        await writer.start()
+
+async def stop_orphan_sheets_writers():
+    await asyncio.gather(*(writer.stop() for writer in orphan_sheets_writers))
+    for writer in orphan_sheets_writers:
+        writer.spool.close()
+    orphan_sheets_writers.clear()
+
+async def post_init(app: Application):
+    startup_timer.mark(f"initialize (getMe: @{app.bot.username})")
+    # Досылаем то, что осталось в спуле с прошлого запуска, и запускаем фоновую запись
+    await sheets_writer.start()
+    if not WORKER_INDEX:
+        await start_orphan_sheets_writers()
+    await users_data.start()
+    await catalog.start(CATALOG_POLL_INTERVAL)
+    await admin_notifier.start(app.bot)
+    await web_server.start()
+    await loop_monitor.start()
+    if update_recorder is not None:
+        await update_recorder.start()
+    if IS_LEADER:
+        # незавершённые рассылки продолжает один процесс, иначе получатели получат дубли
+        broadcasts.resume_all(app.bot)
+        # напоминания тоже шлёт только ведущий; остальные воркеры лишь пишут их в базу
+        await reminders.start(app.bot)
+    startup_timer.mark("post_init")
+    if WARMUP:
+        # Application ещё не запущен, поэтому обычная задача asyncio, а не app.create_task
+        background_tasks.add(asyncio.create_task(warm_up(app)))
+
+async def post_stop(app: Application):
+    # Бот ещё жив (shutdown не вызван) — успеваем дослать уведомления и остановить рассылки
+    await web_server.stop()
+    await loop_monitor.stop()
+    await broadcasts.stop()
+    await reminders.stop()
+    await admin_notifier.stop()
+
+async def post_shutdown(app: Application):
+    await sheets_writer.stop()
+    await stop_orphan_sheets_writers()
+    await users_data.stop()
+    await catalog.stop()
+    if update_recorder is not None:
+        await update_recorder.stop()
+    if state_backend is not None:
+        await state_backend.close()
+    log.info(f"Замеры хендлеров, режим {UX_MODE}:\n{handler_timings.summary()}")
+
+async def timings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        return
+    await update.message.reply_text(
+        f"⏱ Режим {UX_MODE}\n{handler_timings.summary()}\n\n🚦 Лимитер: {rate_limiter.stats()}"
+        f"\n📤 Загрузок файлов: {upload_pool.uploads}, общих с другими: {upload_pool.shared}"
+    )
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/broadcast <предмет> <класс|*> <текст> — рассылка записавшимся на предмет."""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    parts = (update.message.text or "").split(maxsplit=3)
+    if len(parts) < 4:
+        await update.message.reply_text(
+            "Формат: /broadcast <предмет> <класс|*> <текст>\n"
+            "Например: /broadcast Математика EGE Занятие переносится на пятницу"
+        )
+        return
+    _, subject, klass, text = parts
+    klass = None if klass == "*" else klass
+    user_ids = registrations.recipients(subject, klass)
+    if not user_ids:
+        await update.message.reply_text("Получателей не найдено.")
+        return
+    broadcast_id = broadcasts.create(text, subject, klass, user_ids, update.effective_chat.id)
+    broadcasts.start(context.bot, broadcast_id)
+    await update.message.reply_text(f"📣 Рассылка #{broadcast_id} запущена: {len(user_ids)} получателей.")
+
+async def lesson_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/lesson <предмет> <класс|*> <ДД.ММ.ГГГГ> <ЧЧ:ММ> [текст] — занятие и напоминания записавшимся."""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    parts = (update.message.text or "").split(maxsplit=5)
+    try:
+        _, subject, klass, day, hour = parts[:5]
+        naive = datetime.datetime.strptime(f"{day} {hour}", "%d.%m.%Y %H:%M")
+    except ValueError:
+        await update.message.reply_text(
+            "Формат: /lesson <предмет> <класс|*> <ДД.ММ.ГГГГ> <ЧЧ:ММ> [текст]\n"
+            "Например: /lesson Математика EGE 24.10.2026 18:00 Ссылка на урок придёт в чат"
+        )
+        return
+    starts = moscow_now().tzinfo.localize(naive)
+    if starts <= moscow_now():
+        await update.message.reply_text("Это время уже прошло.")
+        return
+    klass = None if klass == "*" else klass
+    user_ids = registrations.recipients(subject, klass)
+    text = f"⏰ Напоминание: занятие по предмету {subject} {starts:%d.%m в %H:%M} (МСК)"
+    if len(parts) > 5:
+        text += f"\n{parts[5]}"
+    lesson_id, count = reminders.add_lesson(subject, klass, starts.timestamp(), text, user_ids)
+    await update.message.reply_text(
+        f"🗓 Занятие #{lesson_id} назначено. Напоминание за {REMINDER_LEAD_MINUTES:g} мин получат {count} чел.; "
+        "записавшиеся позже добавятся сами."
+    )
+
+async def lessons_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/lessons — предстоящие занятия и состояние напоминаний."""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    rows = reminders.upcoming()
+    if not rows:
+        await update.message.reply_text("Предстоящих занятий нет.")
+        return
+    tz = moscow_now().tzinfo
+    lines = [
+        f"#{lesson_id} {subject} {klass or 'все классы'} — "
+        f"{datetime.datetime.fromtimestamp(starts_at, tz):%d.%m %H:%M}, "
+        f"ждут: {pending or 0}, отправлено: {sent or 0}"
+        for lesson_id, subject, klass, starts_at, pending, sent in rows
+    ]
+    await update.message.reply_text("🗓 Занятия:\n" + "\n".join(lines))
+
+async def cancel_lesson_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/cancel_lesson <id> — отменяет занятие и ещё не отправленные напоминания."""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    if len(context.args) != 1 or not context.args[0].isdigit():
+        await update.message.reply_text("Формат: /cancel_lesson <id>")
         return
+    count = reminders.cancel_lesson(int(context.args[0]))
+    await update.message.reply_text(f"Занятие #{context.args[0]} отменено, напоминаний снято: {count}.")
+
+def legacy_material(parts: list):
+    """Старые кнопки material|<предмет>|<номер> -> ID материала из каталога."""
+    _, subject, idx_str = parts
+    files = catalog.for_subject(subject)
+    idx = int(idx_str)
+    return "material", files[idx].id if idx < len(files) else None
+
+codec.legacy("material", legacy_material)
+
+# Callback-кнопки: одна таблица действие -> хендлер
+callback_router = CallbackRouter(codec)
+callback_router.route("role", choose_role)
+callback_router.route("action", student_action)
+callback_router.route("subject", choose_subject)
+callback_router.route("class", class_choice)
+callback_router.route("material", send_material_file)
+
+# Действия в /stats и /export: слово аргумента -> значение action в базе заявок
+STATS_ACTIONS = {"register": "register", "запись": "register", "materials": "materials", "материалы": "materials"}
+STATS_USAGE = ("Формат: [дней] [register|materials] [предмет], например 7 register Математика.\n"
+               "Предметы: " + ", ".join(CHANNELS_BY_SUBJECT))
 
-    app = ApplicationBuilder().token(token).build()
+def parse_period_args(args: list):
+    """[дней] [действие] [предмет] в любом порядке -> (since, subject, action, подпись периода).
+
+    Незнакомое слово — ValueError: опечатка не должна молча стать фильтром по несуществующему предмету.
+    """
+    days, subject, action = None, None, None
+    subjects = {s.lower(): s for s in CHANNELS_BY_SUBJECT}
+    for arg in args:
+        if arg.isdigit() and days is None:
+            days = int(arg)
+        elif arg.lower() in STATS_ACTIONS and action is None:
+            action = STATS_ACTIONS[arg.lower()]
+        elif arg.lower() in subjects and subject is None:
+            subject = subjects[arg.lower()]
+        else:
+            raise ValueError(arg)
+    since = None
+    if days:
+        since = (moscow_now() - datetime.timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    label = f"за {days} дн." if days else "за всё время"
+    for part in (action, subject):
+        if part:
+            label += f", {part}"
+    return since, subject, action, label
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats [дней] [действие] [предмет] — сводка по локальной базе заявок, без обращения к Sheets."""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    try:
+        since, subject, action, label = parse_period_args(context.args)
+    except ValueError as e:
+        await update.message.reply_text(f"Непонятный аргумент: {e}\n{STATS_USAGE}")
+        return
+    stats = await asyncio.to_thread(registrations.stats, since, subject, action)
+
+    def fmt(rows):
+        return ", ".join(f"{name} — {n}" for name, n in rows) or "-"
+
+    text = (
+        f"📊 Статистика {label}\n"
+        f"Всего записей: {stats['total']}\n"
+        f"🧩 Действия: {fmt(stats['action'])}\n"
+        f"📘 Предметы: {fmt(stats['subject'])}\n"
+        f"🧑‍🎓 Классы: {fmt(stats['class'])}\n"
+        f"🎓 Роли: {fmt(stats['role'])}\n"
+        f"Предмет × класс: " + ", ".join(f"{s}/{c} — {n}" for s, c, n in stats["subject_class"]) + "\n"
+        f"Действие × класс: " + ", ".join(f"{a}/{c} — {n}" for a, c, n in stats["action_class"]) + "\n"
+        f"Действие × предмет: " + ", ".join(f"{a}/{s} — {n}" for a, s, n in stats["action_subject"])
+    )
+    await update.message.reply_text(text)
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export [дней] [действие] [предмет] — CSV из локальной базы заявок."""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    try:
+        since, subject, action, label = parse_period_args(context.args)
+    except ValueError as e:
+        await update.message.reply_text(f"Непонятный аргумент: {e}\n{STATS_USAGE}")
+        return
+    fd, path = tempfile.mkstemp(prefix="registrations-", suffix=".csv")
+    os.close(fd)
+    try:
+        count = await asyncio.to_thread(registrations.export_csv, path, since, subject, action)
+        with open(path, "rb") as f:
+            await update.message.reply_document(
+                document=f,
+                filename=f"registrations-{moscow_now():%Y%m%d-%H%M}.csv",
+                caption=f"📄 Экспорт {label}: {count} строк",
+            )
+    finally:
+        os.remove(path)
+
+def build_app(token: str, base_url: str = None) -> Application:
+    """Собирает Application со всеми хендлерами. base_url — для локального фейкового Bot API."""
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .rate_limiter(rate_limiter)
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES, DUPLICATE_TAP_WINDOW, users_data,
+                                                   recorder=update_recorder))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+    app = builder.build()
 
     # Команды
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("timings", timings_command))
+    app.add_handler(CommandHandler("broadcast", broadcast_command))
+    app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("export", export_command))
+    app.add_handler(CommandHandler("lesson", lesson_command))
+    app.add_handler(CommandHandler("lessons", lessons_command))
+    app.add_handler(CommandHandler("cancel_lesson", cancel_lesson_command))
 
     # Callback-кнопки
-    app.add_handler(CallbackQueryHandler(choose_role, pattern=r"^role\|"))
-    app.add_handler(CallbackQueryHandler(student_action, pattern=r"^action\|"))
-    app.add_handler(CallbackQueryHandler(choose_subject, pattern=r"^subject\|"))
-    app.add_handler(CallbackQueryHandler(class_choice, pattern=r"^class\|"))
-    app.add_handler(CallbackQueryHandler(send_material_file, pattern=r"^material\|"))
+    app.add_handler(CallbackQueryHandler(callback_router))
 
     # Текст для никнейма (только когда step == nickname)
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, nickname_input))
@@ -467,12 +970,180 @@ def main():
     # Контакт (телефон)
     app.add_handler(MessageHandler(filters.CONTACT, phone_input))
 
-    print("🤖 Бот запущен...")
-    app.run_polling(allowed_updates=["message", "callback_query"])
+    # Inline-поиск материалов
+    app.add_handler(InlineQueryHandler(inline_query))
 
-if __name__ == "__main__":
-    main()
+    # Изменения подписок в каналах предметов
+    app.add_handler(ChatMemberHandler(chat_member_update, ChatMemberHandler.CHAT_MEMBER))
+
+    web_server.route("GET", "/metrics", metrics_route(app))
+    web_server.route("GET", "/ready", readiness_route(app))
+    startup_timer.mark("сборка Application")
+    return app
+
+def update_backlog(app: Application) -> int:
+    """Апдейты, принятые, но ещё не обработанные: в очереди Application и в процессоре."""
+    return app.update_queue.qsize() + app.update_processor.in_progress
+
+def metrics_route(app: Application):
+    """/metrics в текстовом формате Prometheus; значения-«градусники» читаются в момент запроса."""
+    registry = Registry()
+    registry.register(handler_seconds)
+    registry.gauge("bot_update_queue_depth", "Апдейты в очереди Application", app.update_queue.qsize)
+    registry.gauge("bot_updates_in_progress", "Апдейты в процессоре: ждут очереди пользователя или обрабатываются",
+                   lambda: app.update_processor.in_progress)
+    registry.register(loop_monitor.histogram)
+    registry.gauge("bot_event_loop_lag_max_seconds", "Максимальное опоздание event loop за минуту",
+                   lambda: loop_monitor.max_lag)
+    registry.register(rate_limiter.api_errors)
+    registry.counter("bot_api_retry_after_total", "Ответы 429 (RetryAfter) от Bot API", lambda: rate_limiter.retry_after)
+    registry.gauge("bot_api_outbound_queue_depth", "Запросы, ждущие лимитера отправки",
+                   lambda: rate_limiter.queue_depth)
+    registry.register(sheets_writer.write_seconds)
+    registry.register(sheets_writer.write_errors)
+    registry.gauge("bot_sheets_backlog_rows", "Строки в спуле, ещё не записанные в Google Sheets",
+                   sheets_writer.spool.count)
+    registry.gauge("bot_active_sessions", "Сессии пользователей в памяти процесса", lambda: len(users_data))
+    registry.gauge("bot_reminders_scheduled", "Напоминания в колесе таймеров (у ведущего воркера)",
+                   lambda: len(reminders.wheel))
+    registry.counter("bot_reminders_sent_total", "Отправленные напоминания", lambda: reminders.sent)
 
-    
+    async def handle(request):
+        return 200, registry.render(), "text/plain; version=0.0.4; charset=utf-8"
+    return handle
 
+def readiness_route(app: Application):
+    """/ready: 200, пока бот успевает; 503 с причинами, если event loop или очереди перегружены."""
+    async def handle(request):
+        checks = (
+            ("event_loop_lag_s", round(loop_monitor.max_lag, 3), READY_MAX_LOOP_LAG),
+            ("sheets_backlog", sheets_writer.spool.count(), READY_MAX_SHEETS_BACKLOG),
+            ("update_backlog", update_backlog(app), READY_MAX_UPDATE_BACKLOG),
+        )
+        failed = [f"{name}={value} > {limit}" for name, value, limit in checks if value > limit]
+        if failed:
+            return 503, "not ready: " + ", ".join(failed)
+        return 200, "ready"
+    return handle
+
+def webhook_route(app: Application):
+    """Маршрут вебхука: проверяем секрет и кладём апдейт в очередь Application."""
+    async def handle(request):
+        if WEBHOOK_SECRET and request.headers.get("x-telegram-bot-api-secret-token") != WEBHOOK_SECRET:
+            return 403, "Forbidden"
+        try:
+            update = Update.de_json(json.loads(request.body), app.bot)
+        except Exception as e:
+            log.warning("Некорректный апдейт", extra={"error": str(e)})
+            return 400, "Bad Request"
+        await app.update_queue.put(update)
+        return 200, "OK"
+    return handle
+
+async def run_webhook(app: Application):
+    """Вебхук без отдельного сервера: Application и HTTP-сервер в одном event loop."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    web_server.route("POST", WEBHOOK_PATH, webhook_route(app))
+    await app.initialize()
+    await post_init(app)
+    if not WORKER_INDEX:  # воркерам вебхук уже выставил роутер
+        await set_webhook(app.bot)
+    await app.start()
+    log.info("🤖 Бот запущен (webhook)", extra={"worker": WORKER_INDEX or None})
+    try:
+        await stop.wait()
+    finally:
+        await app.stop()
+        await post_stop(app)
+        await app.shutdown()
+        await post_shutdown(app)
 
+async def set_webhook(bot):
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=ALLOWED_UPDATES,
+    )
+
+def worker_env(index: int) -> dict:
+    """Окружение воркера: свой порт, свой спул Sheets и свой файл записи апдейтов (остальные базы SQLite общие)."""
+    root, ext = os.path.splitext(SHEETS_SPOOL_FILE)
+    env = {"WORKER_INDEX": str(index), "PORT": str(PORT + 1 + index),
+           "SHEETS_SPOOL_FILE": f"{root}.{index}{ext}"}
+    if RECORD_UPDATES_FILE:
+        # replay сводит файлы воркеров по времени прихода
+        folder, name = os.path.split(RECORD_UPDATES_FILE)
+        stem, dot, ext = name.partition(".")
+        env["RECORD_UPDATES_FILE"] = os.path.join(folder, f"{stem}.{index}{dot}{ext}")
+    return env
+
+async def run_router(token: str):
+    """Процесс-роутер: держит вебхук и раздаёт апдейты BOT_WORKERS воркерам по id пользователя."""
+    from telegram import Bot
+    from workers import UpdateRouter, spawn_workers, stop_workers
+
+    if state_backend is None:
+        log.warning("STATE_BACKEND не задан: сессии и кэши у каждого воркера свои")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    envs = [worker_env(i) for i in range(BOT_WORKERS)]
+    processes = spawn_workers(__file__, envs)
+    # свои строки роутер не пишет, но досылает спулы, оставшиеся без воркера (в т.ч. свой SHEETS_SPOOL_FILE)
+    await sheets_writer.start()
+    await start_orphan_sheets_writers()
+    router = UpdateRouter([f"http://127.0.0.1:{env['PORT']}{WEBHOOK_PATH}" for env in envs], WEBHOOK_SECRET)
+    web_server.route("POST", WEBHOOK_PATH, router.handle)
+    await web_server.start()
+    bot = Bot(token)
+    await bot.initialize()
+    await set_webhook(bot)
+    log.info("🤖 Роутер запущен", extra={"workers": BOT_WORKERS})
+    try:
+        while not stop.is_set():
+            # упавший воркер перезапускаем; его апдейты Telegram тем временем повторит сам
+            for i, process in enumerate(processes):
+                if process.poll() is not None:
+                    log.error("Воркер завершился, перезапускаем", extra={"worker": i, "code": process.returncode})
+                    processes[i] = spawn_workers(__file__, [envs[i]])[0]
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await web_server.stop()
+        await asyncio.to_thread(stop_workers, processes)
+        await router.close()
+        await bot.shutdown()
+        await sheets_writer.stop()
+        await stop_orphan_sheets_writers()
+
+def main():
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        log.error("❌ BOT_TOKEN не задан в переменных окружения.")
+        return
+
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            log.error("❌ WEBHOOK_URL не задан, а BOT_MODE=webhook.")
+            return
+        if BOT_WORKERS > 1 and not WORKER_INDEX:
+            asyncio.run(run_router(token))
+        else:
+            asyncio.run(run_webhook(build_app(token)))
+        return
+
+    app = build_app(token)
+    log.info("🤖 Бот запущен (polling)")
+    app.run_polling(allowed_updates=ALLOWED_UPDATES)
+
+if __name__ == "__main__":
+    main()
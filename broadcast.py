@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import sqlite3
+import time
+
+from telegram import Bot
+from telegram.error import Forbidden
+
+from rate_limit import BULK
+
+log = logging.getLogger(__name__)
+
+PENDING, SENDING, SENT, FAILED, BLOCKED = "pending", "sending", "sent", "failed", "blocked"
+
+
+class BroadcastEngine:
+    """Рассылки админа с сохранением прогресса.
+
+    Получатели рассылки записываются в SQLite заранее. Перед отправкой строка
+    помечается как sending, после — sent/failed/blocked. После падения рассылка
+    продолжается с pending, а sending считается уже отправленным: лучше не дослать
+    одно сообщение, чем прислать его дважды.
+
+    Состояния меняются пачками по batch_size получателей — две транзакции на пачку,
+    а не две на каждого: на десятках тысяч получателей коммиты иначе держат event loop.
+    """
+
+    def __init__(self, path: str, workers: int = 8, batch_size: int = 100):
+        self.workers = workers
+        self.batch_size = batch_size
+        self._running = {}  # broadcast_id -> Task
+        self.conn = sqlite3.connect(path)
+        # WAL: коммит без fsync основного файла — пишем из event loop
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS broadcasts ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT NOT NULL, subject TEXT, class TEXT,"
+            " report_chat_id INTEGER, created_at REAL NOT NULL, finished_at REAL);"
+            "CREATE TABLE IF NOT EXISTS broadcast_recipients ("
+            " broadcast_id INTEGER NOT NULL, user_id INTEGER NOT NULL, state TEXT NOT NULL,"
+            " PRIMARY KEY (broadcast_id, user_id));"
+            "CREATE INDEX IF NOT EXISTS broadcast_recipients_state ON broadcast_recipients (broadcast_id, state);"
+        )
+        self.conn.commit()
+
+    def create(self, text: str, subject: str, klass: str, user_ids: list, report_chat_id: int) -> int:
+        cur = self.conn.execute(
+            "INSERT INTO broadcasts (text, subject, class, report_chat_id, created_at) VALUES (?, ?, ?, ?, ?)",
+            (text, subject, klass, report_chat_id, time.time()),
+        )
+        broadcast_id = cur.lastrowid
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id, state) VALUES (?, ?, ?)",
+            [(broadcast_id, user_id, PENDING) for user_id in user_ids],
+        )
+        self.conn.commit()
+        return broadcast_id
+
+    def start(self, bot: Bot, broadcast_id: int):
+        if broadcast_id not in self._running:
+            task = asyncio.create_task(self._run(bot, broadcast_id))
+            self._running[broadcast_id] = task
+            task.add_done_callback(lambda _: self._running.pop(broadcast_id, None))
+
+    def resume_all(self, bot: Bot):
+        """Продолжить рассылки, прерванные перезапуском."""
+        for (broadcast_id,) in self.conn.execute("SELECT id FROM broadcasts WHERE finished_at IS NULL").fetchall():
+            log.info("Продолжаем рассылку", extra={"broadcast_id": broadcast_id})
+            self.start(bot, broadcast_id)
+
+    async def stop(self):
+        for task in list(self._running.values()):
+            task.cancel()
+        await asyncio.gather(*self._running.values(), return_exceptions=True)
+
+    def _claim(self, broadcast_id: int):
+        """Следующая пачка pending-получателей, помеченная sending одной транзакцией.
+
+        Каждая строка забирается условным UPDATE ... AND state = pending: если ту же рассылку
+        параллельно ведёт другой процесс (перезапущенный лидер рядом со старым), получателя
+        забирает только один из них. None — pending-получателей не осталось.
+        """
+        user_ids = [row[0] for row in self.conn.execute(
+            "SELECT user_id FROM broadcast_recipients WHERE broadcast_id = ? AND state = ? LIMIT ?",
+            (broadcast_id, PENDING, self.batch_size),
+        )]
+        if not user_ids:
+            return None
+        claimed = []
+        for user_id in user_ids:
+            cur = self.conn.execute(
+                "UPDATE broadcast_recipients SET state = ? WHERE broadcast_id = ? AND user_id = ? AND state = ?",
+                (SENDING, broadcast_id, user_id, PENDING),
+            )
+            if cur.rowcount == 1:
+                claimed.append(user_id)
+        self.conn.commit()
+        return claimed
+
+    def _set_states(self, broadcast_id: int, states: list):
+        """states — [(состояние, user_id)]."""
+        if not states:
+            return
+        self.conn.executemany(
+            "UPDATE broadcast_recipients SET state = ? WHERE broadcast_id = ? AND user_id = ?",
+            [(state, broadcast_id, user_id) for state, user_id in states],
+        )
+        self.conn.commit()
+
+    def counts(self, broadcast_id: int) -> dict:
+        rows = self.conn.execute(
+            "SELECT state, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY state", (broadcast_id,)
+        )
+        return dict(rows.fetchall())
+
+    async def _run(self, bot: Bot, broadcast_id: int):
+        text, report_chat_id = self.conn.execute(
+            "SELECT text, report_chat_id FROM broadcasts WHERE id = ?", (broadcast_id,)
+        ).fetchone()
+        started = time.monotonic()
+        total = 0
+
+        async def worker(queue: asyncio.Queue, results: list):
+            while not queue.empty():
+                user_id = queue.get_nowait()
+                try:
+                    await bot.send_message(chat_id=user_id, text=text, rate_limit_args={"priority": BULK})
+                    state = SENT
+                except Forbidden:
+                    state = BLOCKED  # пользователь заблокировал бота
+                except Exception as e:
+                    log.warning("Ошибка отправки в рассылке", extra={"broadcast_id": broadcast_id, "user_id": user_id, "error": str(e)})
+                    state = FAILED
+                results.append((state, user_id))
+
+        while True:
+            batch = self._claim(broadcast_id)
+            if batch is None:
+                break
+            if not batch:
+                continue  # всю пачку забрал другой процесс
+            total += len(batch)
+            queue = asyncio.Queue()
+            for user_id in batch:
+                queue.put_nowait(user_id)
+            results = []
+            try:
+                await asyncio.gather(*(worker(queue, results) for _ in range(self.workers)))
+            finally:
+                # и при остановке: уже отправленные не должны остаться в sending, а до кого очередь
+                # не дошла — возвращаются в pending; sending остаются только прерванные на отправке
+                while not queue.empty():
+                    results.append((PENDING, queue.get_nowait()))
+                self._set_states(broadcast_id, results)
+        elapsed = time.monotonic() - started
+        cur = self.conn.execute("UPDATE broadcasts SET finished_at = ? WHERE id = ? AND finished_at IS NULL",
+                                (time.time(), broadcast_id))
+        self.conn.commit()
+        if cur.rowcount == 0:
+            return  # рассылку завершил и отчитался другой процесс
+
+        counts = self.counts(broadcast_id)
+        report = (
+            f"📣 Рассылка #{broadcast_id} завершена\n"
+            f"✅ Отправлено: {counts.get(SENT, 0)}\n"
+            f"⛔ Заблокировали бота: {counts.get(BLOCKED, 0)}\n"
+            f"❌ Ошибки: {counts.get(FAILED, 0)}\n"
+            f"⏱ {elapsed:.1f} с, {total / elapsed if elapsed else 0:.1f} сообщ./с"
+        )
+        if counts.get(SENDING):
+            report += f"\n❔ Статус неизвестен (прервано): {counts[SENDING]}"
+        try:
+            await bot.send_message(chat_id=report_chat_id, text=report)
+        except Exception as e:
+            log.warning("Не удалось отправить отчёт о рассылке", extra={"broadcast_id": broadcast_id, "error": str(e)})
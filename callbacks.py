@@ -0,0 +1,100 @@
+import base64
+
+# Порядок значений менять нельзя — индекс зашит в уже отправленные кнопки; новые добавлять в конец
+ROLES = ("student", "parent", "university", "teacher")
+ACTIONS = ("register", "materials")
+SUBJECTS = ("Математика", "Физика", "Химия", "Биология", "Русский", "Биохимия")
+CLASSES = ("5", "6", "7", "8", "10", "OGE", "EGE")
+
+
+class CallbackCodec:
+    """Компактный формат callback_data: "~" + base64url(версия, id действия, аргумент).
+
+    Аргумент — либо индекс в таблице значений (1 байт), либо hex-ID фиксированной длины.
+    Кнопки старого формата ("role|student", "material|Физика|0" и т.п.) разбираются
+    зарегистрированными legacy-парсерами, чтобы старые сообщения в чатах продолжали работать.
+    """
+
+    PREFIX = "~"
+    VERSION = 1
+
+    def __init__(self):
+        self._by_name = {}  # имя -> (action_id, таблица или None, длина hex в байтах)
+        self._by_id = {}    # action_id -> имя
+        self._legacy = {}   # префикс старого формата -> parser(parts) -> (имя, значение)
+
+    def enum(self, action_id: int, name: str, values: tuple):
+        self._by_name[name] = (action_id, values, 0)
+        self._by_id[action_id] = name
+
+    def hex(self, action_id: int, name: str, size: int):
+        self._by_name[name] = (action_id, None, size)
+        self._by_id[action_id] = name
+
+    def legacy(self, prefix: str, parser):
+        self._legacy[prefix] = parser
+
+    def encode(self, name: str, value: str) -> str:
+        action_id, values, size = self._by_name[name]
+        arg = bytes([values.index(value)]) if values is not None else bytes.fromhex(value)
+        if values is None and len(arg) != size:
+            raise ValueError(f"{name}: ожидается {size} байт, получено {len(arg)}")
+        raw = bytes([self.VERSION, action_id]) + arg
+        return self.PREFIX + base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+    def decode(self, data: str):
+        """(имя, значение) или None, если формат не распознан."""
+        if not data:
+            return None
+        if data.startswith(self.PREFIX):
+            body = data[len(self.PREFIX):]
+            try:
+                raw = base64.urlsafe_b64decode(body + "=" * (-len(body) % 4))
+            except ValueError:
+                return None
+            if len(raw) < 3 or raw[0] != self.VERSION or raw[1] not in self._by_id:
+                return None
+            name = self._by_id[raw[1]]
+            _, values, size = self._by_name[name]
+            if values is not None:
+                return (name, values[raw[2]]) if raw[2] < len(values) and len(raw) == 3 else None
+            return (name, raw[2:].hex()) if len(raw) == 2 + size else None
+        parts = data.split("|")
+        parser = self._legacy.get(parts[0])
+        if parser is None:
+            return None
+        try:
+            return parser(parts)
+        except (ValueError, IndexError):
+            return None
+
+
+codec = CallbackCodec()
+codec.enum(1, "role", ROLES)
+codec.enum(2, "action", ACTIONS)
+codec.enum(3, "subject", SUBJECTS)
+codec.enum(4, "class", CLASSES)
+codec.hex(5, "material", 4)
+for _name in ("role", "action", "subject", "class"):
+    codec.legacy(_name, lambda parts, name=_name: (name, parts[1]))
+codec.legacy("mat", lambda parts: ("material", parts[1]))
+
+
+class CallbackRouter:
+    """Один CallbackQueryHandler вместо набора regex: декодируем и берём хендлер из таблицы."""
+
+    def __init__(self, codec: CallbackCodec):
+        self.codec = codec
+        self.routes = {}
+
+    def route(self, name: str, handler):
+        self.routes[name] = handler
+
+    async def __call__(self, update, context):
+        q = update.callback_query
+        decoded = self.codec.decode(q.data)
+        handler = self.routes.get(decoded[0]) if decoded else None
+        if handler is None:
+            await q.answer("Кнопка устарела, начните заново: /start")
+            return
+        return await handler(update, context, decoded[1])
@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import logging
+import os
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from callbacks import codec
+from search import SearchIndex
+
+log = logging.getLogger(__name__)
+
+MATERIAL_EXTENSIONS = (".pdf", ".docx", ".png", ".jpg")
+
+# Папка в materials/ -> предмет (папка может называться и самим предметом)
+SUBJECT_DIRS = {
+    "math": "Математика",
+    "physics": "Физика",
+    "chemistry": "Химия",
+    "biology": "Биология",
+    "russian": "Русский",
+    "biochemistry": "Биохимия",
+}
+
+# Человеческие названия файлов (путь внутри materials/ -> название);
+# остальные файлы показываются по имени
+MATERIAL_TITLES = {
+    "math/Circle.pdf": "Свойства окружности.pdf",
+    "math/Vectors.pdf": "Гайд векторы.pdf",
+    "physics/mechanics.pdf": "Основы механики.pdf",
+    "chemistry/periodic_table.pdf": "Таблица Менделеева.pdf",
+    "biology/cell_biology.pdf": "Клеточная биология.pdf",
+    "russian/orthography_rules.pdf": "Правила орфографии.pdf",
+    "biochemistry/basics.pdf": "Основы биохимии.pdf",
+}
+
+
+_TITLE_ORDER = {title: i for i, title in enumerate(MATERIAL_TITLES.values())}
+
+
+def _order(material) -> tuple:
+    # сначала файлы из MATERIAL_TITLES в заданном порядке, затем остальные по алфавиту
+    return _TITLE_ORDER.get(material.title, len(_TITLE_ORDER)), material.title
+
+
+def material_id(path: str) -> str:
+    """Короткий стабильный ID по пути: влезает в callback_data с большим запасом."""
+    return hashlib.sha1(path.encode("utf-8")).hexdigest()[:8]
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Material:
+    __slots__ = ("id", "subject", "title", "path", "size", "mtime_ns", "sha256")
+
+    def __init__(self, subject: str, title: str, path: str, size: int, mtime_ns: int, sha256: str):
+        self.id = material_id(path)
+        self.subject = subject
+        self.title = title
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.sha256 = sha256
+
+
+class MaterialsCatalog:
+    """Индекс материалов из дерева materials/<предмет>/<файл>.
+
+    Строится один раз, дальше обновляется инкрементально опросом mtime:
+    хэш пересчитывается только для изменившихся файлов, клавиатуры — только
+    для затронутых предметов, поисковый индекс — при любом изменении.
+    Хендлеры диск не трогают.
+    """
+
+    def __init__(self, root: str = "materials"):
+        self.root = root
+        self.by_id = {}
+        self._by_subject = {}
+        self._keyboards = {}
+        self._search = SearchIndex([])
+        self._loaded = False
+        self._task = None
+
+    def _scan(self) -> dict:
+        """path -> (subject, title, size, mtime_ns) по текущему состоянию диска."""
+        found = {}
+        if not os.path.isdir(self.root):
+            return found
+        for entry in os.scandir(self.root):
+            if not entry.is_dir():
+                continue
+            subject = SUBJECT_DIRS.get(entry.name, entry.name)
+            for f in os.scandir(entry.path):
+                if f.is_file() and f.name.lower().endswith(MATERIAL_EXTENSIONS):
+                    st = f.stat()
+                    rel = f"{entry.name}/{f.name}"
+                    title = MATERIAL_TITLES.get(rel, f.name)
+                    found[os.path.join(self.root, entry.name, f.name)] = (subject, title, st.st_size, st.st_mtime_ns)
+        return found
+
+    def _diff(self):
+        """Читает диск и возвращает новое состояние индекса (выполняется в потоке)."""
+        current = {m.path: m for m in self.by_id.values()}
+        by_id = {}
+        for path, (subject, title, size, mtime_ns) in self._scan().items():
+            old = current.get(path)
+            if old and old.size == size and old.mtime_ns == mtime_ns and old.subject == subject and old.title == title:
+                by_id[old.id] = old
+                continue
+            try:
+                sha = file_sha256(path)
+            except OSError:
+                continue
+            material = Material(subject, title, path, size, mtime_ns, sha)
+            by_id[material.id] = material
+        return by_id
+
+    def _apply(self, by_id: dict) -> set:
+        changed = {m.subject for m in by_id.values() if self.by_id.get(m.id) is not m}
+        changed |= {m.subject for m in self.by_id.values() if m.id not in by_id}
+        self.by_id = by_id
+        self._loaded = True
+        for subject in changed:
+            items = sorted((m for m in by_id.values() if m.subject == subject), key=_order)
+            if items:
+                self._by_subject[subject] = items
+                self._keyboards[subject] = InlineKeyboardMarkup(
+                    [[InlineKeyboardButton(m.title, callback_data=codec.encode("material", m.id))] for m in items]
+                )
+            else:
+                self._by_subject.pop(subject, None)
+                self._keyboards.pop(subject, None)
+        if changed:
+            self._search = SearchIndex(m for subject in sorted(self._by_subject) for m in self._by_subject[subject])
+        return changed
+
+    def refresh(self) -> set:
+        """Синхронное обновление; возвращает предметы, у которых поменялся список."""
+        return self._apply(self._diff())
+
+    async def refresh_async(self) -> set:
+        return self._apply(await asyncio.to_thread(self._diff))
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.refresh()
+
+    def get(self, material_id_: str):
+        self._ensure_loaded()
+        return self.by_id.get(material_id_)
+
+    def for_subject(self, subject: str) -> list:
+        self._ensure_loaded()
+        return self._by_subject.get(subject, [])
+
+    def keyboard(self, subject: str):
+        self._ensure_loaded()
+        return self._keyboards.get(subject)
+
+    def search(self, query: str, limit: int = 50) -> list:
+        """Материалы по запросу (название, предмет, имя файла) — для inline-режима."""
+        self._ensure_loaded()
+        return self._search.search(query, limit)
+
+    def all(self) -> list:
+        self._ensure_loaded()
+        return list(self.by_id.values())
+
+    async def start(self, interval: float = 30.0):
+        """Запускает опрос изменений; первичное построение — при прогреве или первом обращении."""
+        if self._task is None and interval > 0:
+            self._task = asyncio.create_task(self._poll(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _poll(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                changed = await self.refresh_async()
+                if changed:
+                    log.info("Обновлены материалы", extra={"subjects": sorted(changed)})
+            except Exception:
+                log.exception("Ошибка обновления каталога")
+
+
+# Общий каталог для bot.py и materials.py
+catalog = MaterialsCatalog(os.getenv("MATERIALS_DIR", "materials"))
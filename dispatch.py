@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from tracing import tracer
+
+log = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов разных пользователей с порядком внутри одного.
+
+    Апдейты одного пользователя идут строго по очереди (per-user lock), поэтому
+    двойное нажатие не гоняется за одну сессию. Одинаковые нажатия кнопки
+    (тот же пользователь, сообщение и callback_data) в пределах dedup_window
+    отбрасываются — на них только отвечаем, чтобы у клиента пропали «часики».
+    Если задано sessions, сессия пользователя подтягивается из общего бэкенда до хендлера.
+    Если задан recorder, каждый апдейт (и повторные нажатия тоже) записывается в момент прихода.
+
+    process_update у PTB финальный и берёт свой семафор раньше do_process_update, то есть
+    до очереди пользователя. Поэтому базовому классу отдаётся заведомо большой лимит, а
+    max_concurrent_updates соблюдается собственным семафором внутри do_process_update.
+    """
+
+    ADMISSION_LIMIT = 1_000_000  # лимит базового семафора: на практике не ограничивает
+
+    def __init__(self, max_concurrent_updates: int = 64, dedup_window: float = 1.0, sessions=None,
+                 recorder=None):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(self.ADMISSION_LIMIT)
+        self._max_concurrent_updates = max_concurrent_updates  # его и показывает Application.concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self.dedup_window = dedup_window
+        self.sessions = sessions
+        self.recorder = recorder
+        self._locks = {}  # user_id -> [Lock, число ожидающих]
+        self._recent_taps = {}  # (user_id, message_id, data) -> время нажатия
+        self.dropped_taps = 0
+        self.in_progress = 0  # принятые апдейты: ждут очереди пользователя/слота или обрабатываются
+
+    @staticmethod
+    def _user_id(update: object):
+        if isinstance(update, Update) and update.effective_user:
+            return update.effective_user.id
+        return None
+
+    @staticmethod
+    def _kind(update: object):
+        """Тип апдейта для трассировки: message, callback_query, chat_member, ..."""
+        if not isinstance(update, Update):
+            return type(update).__name__
+        return next((name for name in Update.ALL_TYPES if getattr(update, name, None) is not None), None)
+
+    def _is_duplicate_tap(self, update: object) -> bool:
+        if not isinstance(update, Update) or update.callback_query is None:
+            return False
+        q = update.callback_query
+        message_id = q.message.message_id if q.message else q.inline_message_id
+        key = (q.from_user.id, message_id, q.data)
+        now = time.monotonic()
+        if len(self._recent_taps) > 10_000:
+            self._recent_taps = {k: t for k, t in self._recent_taps.items() if now - t < self.dedup_window}
+        last = self._recent_taps.get(key)
+        self._recent_taps[key] = now
+        return last is not None and now - last < self.dedup_window
+
+    async def do_process_update(self, update: object, coroutine):
+        if self.recorder is not None and isinstance(update, Update):
+            self.recorder.record(update)
+        if self._is_duplicate_tap(update):
+            self.dropped_taps += 1
+            coroutine.close()
+            try:
+                await update.callback_query.answer()
+            except Exception as e:
+                log.debug("Не удалось ответить на повторное нажатие: %s", e)
+            return
+
+        self.in_progress += 1
+        try:
+            await self._process(update, coroutine)
+        finally:
+            self.in_progress -= 1
+
+    async def _process(self, update: object, coroutine):
+        user_id = self._user_id(update)
+        with tracer.trace("update", kind=self._kind(update), user_id=user_id) as attrs:
+            started = time.perf_counter()
+            if user_id is None:
+                async with self._slots:
+                    attrs["wait_ms"] = round((time.perf_counter() - started) * 1000, 2)
+                    await coroutine
+                return
+
+            # Сначала очередь пользователя, потом общий слот: ждущие апдейты одного
+            # пользователя не занимают слоты, нужные другим
+            entry = self._locks.setdefault(user_id, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    async with self._slots:
+                        attrs["wait_ms"] = round((time.perf_counter() - started) * 1000, 2)
+                        if self.sessions is not None:
+                            await self.sessions.preload(user_id)
+                        await coroutine
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._locks.pop(user_id, None)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,60 @@
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+
+class FileIdCache:
+    """Кэш Telegram file_id для файлов материалов.
+
+    Ключ — путь к файлу, запись действительна, пока у файла не поменялись размер и mtime.
+    Хранится в JSON, чтобы переживать перезапуски.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._data = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except Exception as e:
+                log.warning("Не удалось прочитать кэш file_id", extra={"path": path, "error": str(e)})
+
+    @staticmethod
+    def signature(filepath: str):
+        st = os.stat(filepath)
+        return [st.st_size, st.st_mtime_ns]
+
+    def get(self, filepath: str):
+        entry = self._data.get(filepath)
+        if not entry:
+            return None
+        try:
+            if entry["sig"] != self.signature(filepath):
+                return None
+        except OSError:
+            return None
+        return entry["file_id"]
+
+    def put(self, filepath: str, file_id: str):
+        try:
+            self._data[filepath] = {"sig": self.signature(filepath), "file_id": file_id}
+        except OSError:
+            return
+        self._save()
+
+    def drop(self, filepath: str):
+        if self._data.pop(filepath, None) is not None:
+            self._save()
+
+    def _save(self):
+        tmp = f"{self.path}.{os.getpid()}.tmp"  # несколько воркеров пишут один файл
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+# Общий кэш для bot.py и materials.py
+file_id_cache = FileIdCache(os.getenv("FILE_ID_CACHE_FILE", "file_ids.json"))
@@ -1,15 +1,122 @@
-from flask import Flask
-from threading import Thread
+import asyncio
+import logging
+from urllib.parse import urlsplit
 
-app = Flask('')
+log = logging.getLogger(__name__)
 
-@app.route('/')
-def home():
-    return "✅ Бот работает!"
+MAX_BODY = 1024 * 1024  # апдейты Telegram заметно меньше
+READ_TIMEOUT = 10.0
 
-def run():
-    app.run(host="0.0.0.0", port=8080)
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error",
+           503: "Service Unavailable"}
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
+
+class Request:
+    def __init__(self, method: str, path: str, query: str, headers: dict, body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+
+class WebServer:
+    """Минимальный HTTP-сервер на asyncio в том же event loop, что и бот.
+
+    Заменяет Flask-поток: health-check и вебхук Telegram обслуживаются одним портом.
+    Хендлер маршрута — корутина request -> (status, body[, content_type]).
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 8080, max_connections: int = 40):
+        self.host = host
+        self.port = port
+        self._slots = asyncio.Semaphore(max_connections)
+        self._routes = {}
+        self._server = None
+        self.route("GET", "/", self._home)
+
+    def route(self, method: str, path: str, handler):
+        self._routes[(method, path)] = handler
+
+    @staticmethod
+    async def _home(request: Request):
+        return 200, "✅ Бот работает!"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        log.info("HTTP-сервер слушает %s:%s", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        async with self._slots:
+            try:
+                request = await asyncio.wait_for(self._read_request(reader), READ_TIMEOUT)
+                if isinstance(request, int):
+                    status, body, content_type = request, REASONS[request], "text/plain"
+                else:
+                    status, body, content_type = await self._dispatch(request)
+                await self._write_response(writer, status, body, content_type)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                pass
+            except Exception:
+                log.exception("Ошибка обработки HTTP-запроса")
+            finally:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except Exception:
+                    pass
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        parts = request_line.split(" ")
+        if len(parts) != 3:
+            return 400
+        method, target, _ = parts
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            return 400
+        if length > MAX_BODY:
+            return 413
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(target)
+        return Request(method, url.path, url.query, headers, body)
+
+    async def _dispatch(self, request: Request):
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            known_path = any(path == request.path for _, path in self._routes)
+            status = 405 if known_path else 404
+            return status, REASONS[status], "text/plain"
+        result = await handler(request)
+        if len(result) == 2:
+            return result[0], result[1], "text/plain; charset=utf-8"
+        return result
+
+    @staticmethod
+    async def _write_response(writer: asyncio.StreamWriter, status: int, body, content_type: str):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, 'OK')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
@@ -1,35 +1,20 @@
 import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import ContextTypes
 
-from user_data import users_data  # если у тебя есть отдельный файл с user-данными
+from callbacks import codec
+from catalog import catalog
+from sessions import users_data
+from uploads import FileTooLarge, upload_pool
 
 def get_topic_keyboard(subject):
-    path = os.path.join("materials", subject)
-    if not os.path.exists(path):
-        return None
-
-    files = [
-        f for f in os.listdir(path)
-        if os.path.isfile(os.path.join(path, f)) and f.endswith((".pdf", ".docx", ".png", ".jpg"))
-    ]
-
-    buttons = [
-        [InlineKeyboardButton(text=os.path.splitext(f)[0], callback_data=f"{subject}|{f}")]
-        for f in files
-    ]
-
-    return InlineKeyboardMarkup(buttons)
+    # Клавиатуры собираются заранее в каталоге, диск здесь не читаем
+    return catalog.keyboard(subject)
 
 
 async def send_topics(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    username = update.effective_user.username
-    user_subject = None
-
-    for user in users_data.values():
-        if user.get("username") == username:
-            user_subject = user.get("subject")
-            break
+    session = users_data.get(update.effective_user.id)
+    user_subject = session.get("subject") if session else None
 
     if not user_subject:
         await update.message.reply_text("Ты пока не записан. Напиши /start.")
@@ -50,17 +35,16 @@ async def handle_material_callback(update: Update, context: ContextTypes.DEFAULT
     await query.answer()
 
     try:
-        subject, filename = query.data.split("|")
-        filepath = os.path.join("materials", subject, filename)
-
-        if os.path.exists(filepath):
-            with open(filepath, "rb") as f:
-                await query.message.reply_document(
-                    document=f,
-                    filename=filename,
-                    caption=f"📘 Тема: {os.path.splitext(filename)[0]}"
-                )
+        decoded = codec.decode(query.data)
+        material = catalog.get(decoded[1]) if decoded and decoded[0] == "material" else None
+        if material is not None:
+            await upload_pool.reply(
+                query.message, material.path, os.path.basename(material.path), material.size,
+                caption=f"📘 Тема: {os.path.splitext(material.title)[0]}"
+            )
         else:
             await query.message.reply_text("Файл не найден.")
+    except FileTooLarge:
+        await query.message.reply_text("Файл слишком большой для Telegram (больше 50 МБ).")
     except Exception as e:
         await query.message.reply_text(f"Ошибка при отправке файла: {e}")
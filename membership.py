@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+
+from telegram import Bot, ChatMemberUpdated
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from state import StateError
+
+log = logging.getLogger(__name__)
+
+MEMBER_STATUSES = ("member", "creator", "administrator")
+
+
+class MembershipCache:
+    """Кэш подписок (канал, пользователь) -> подписан ли.
+
+    Положительный и отрицательный ответы живут разное время: подписку проверяем редко,
+    а отказ — быстро, чтобы только что подписавшийся пользователь не ждал.
+    Одновременные запросы по одному ключу объединяются в один вызов get_chat_member.
+    Записи обновляются и событиями chat_member, которые Telegram присылает сам.
+    С общим бэкендом ответы видны всем воркерам: локальный словарь — первый уровень, бэкенд — второй.
+    """
+
+    KEY = "member:{}:{}"
+
+    def __init__(self, positive_ttl: float = 600.0, negative_ttl: float = 15.0, max_size: int = 100_000,
+                 backend=None):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.backend = backend
+        self._entries = {}   # (channel, user_id) -> (подписан, истекает_в)
+        self._inflight = {}  # (channel, user_id) -> Future
+
+    @staticmethod
+    def _key(channel: str, user_id: int):
+        return channel.lower(), user_id
+
+    def set(self, channel: str, user_id: int, subscribed: bool):
+        ttl = self.positive_ttl if subscribed else self.negative_ttl
+        if len(self._entries) >= self.max_size:
+            # выкидываем самую старую запись (dict хранит порядок вставки)
+            self._entries.pop(next(iter(self._entries)))
+        key = self._key(channel, user_id)
+        self._entries.pop(key, None)
+        self._entries[key] = (subscribed, time.monotonic() + ttl)
+
+    async def _share(self, channel: str, user_id: int, subscribed: bool):
+        if self.backend is None:
+            return
+        ttl = self.positive_ttl if subscribed else self.negative_ttl
+        try:
+            await self.backend.set(self.KEY.format(*self._key(channel, user_id)), "1" if subscribed else "0", ttl)
+        except StateError as e:
+            log.warning("Не удалось сохранить подписку в общий кэш", extra={"error": str(e)})
+
+    async def _shared(self, channel: str, user_id: int):
+        if self.backend is None:
+            return None
+        try:
+            raw = await self.backend.get(self.KEY.format(*self._key(channel, user_id)))
+        except StateError as e:
+            log.warning("Общий кэш подписок недоступен", extra={"error": str(e)})
+            return None
+        return None if raw is None else raw == "1"
+
+    async def is_member(self, bot: Bot, channel: str, user_id: int) -> bool:
+        key = self._key(channel, user_id)
+        entry = self._entries.get(key)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            subscribed = await self._shared(channel, user_id)
+            if subscribed is None:
+                member = await bot.get_chat_member(chat_id=channel, user_id=user_id)
+                subscribed = member.status in MEMBER_STATUSES
+                await self._share(channel, user_id, subscribed)
+            self.set(channel, user_id, subscribed)
+        except BadRequest as e:
+            # подкласс NetworkError, но это «chat not found» / «member list is inaccessible» — настройка, а не сбой
+            subscribed = self._misconfigured(channel, user_id, e)
+        except (NetworkError, RetryAfter) as e:
+            # Сбой сети или флуд-лимит — не повод отказывать: отдаём последнее известное значение
+            subscribed = entry[0] if entry else True
+            log.warning("Ошибка проверки подписки, используем %s", "кэш" if entry else "допуск",
+                        extra={"channel": channel, "user_id": user_id, "error": str(e)})
+        except Exception as e:
+            subscribed = self._misconfigured(channel, user_id, e)
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        future.set_result(subscribed)
+        return subscribed
+
+    def _misconfigured(self, channel: str, user_id: int, error: Exception) -> bool:
+        """Ответ, который не исправится повтором (канал не найден, бот не админ, Forbidden):
+        не пропускаем, а отказ кэшируем, чтобы не дёргать API на каждое нажатие."""
+        log.error("Проверка подписки невозможна, проверьте канал и права бота",
+                  extra={"channel": channel, "user_id": user_id, "error": str(error)})
+        self.set(channel, user_id, False)
+        return False
+
+    async def on_chat_member(self, event: ChatMemberUpdated):
+        """Обновление из апдейта chat_member (бот должен быть админом канала)."""
+        chat = event.chat
+        subscribed = event.new_chat_member.status in MEMBER_STATUSES
+        user_id = event.new_chat_member.user.id
+        channels = [str(chat.id)] + ([f"@{chat.username}"] if chat.username else [])
+        for channel in channels:
+            self.set(channel, user_id, subscribed)
+            await self._share(channel, user_id, subscribed)
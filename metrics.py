@@ -0,0 +1,173 @@
+import asyncio
+import bisect
+import time
+from collections import deque
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонный счётчик с метками."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def samples(self):
+        if not self._values and not self.labelnames:
+            yield self.name, "", 0
+        for key, value in sorted(self._values.items()):
+            yield self.name, _labels(self.labelnames, key), value
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus: накопительные бакеты, сумма и число наблюдений."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # метки -> [счётчики по бакетам..., +Inf], сумма
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for key, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", _labels(self.labelnames, key, f'le="{_number(bound)}"'), cumulative
+            yield f"{self.name}_sum", _labels(self.labelnames, key), total
+            yield f"{self.name}_count", _labels(self.labelnames, key), cumulative
+
+
+class Callback:
+    """Значение читается в момент запроса /metrics: fn() -> число или {кортеж меток: число}."""
+
+    def __init__(self, kind: str, name: str, help_text: str, fn, labelnames: tuple = ()):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.labelnames = labelnames
+
+    def samples(self):
+        value = self.fn()
+        if isinstance(value, dict):
+            for key, v in sorted(value.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                yield self.name, _labels(self.labelnames, key), v
+        else:
+            yield self.name, "", value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, fn, labelnames: tuple = ()):
+        return self.register(Callback("gauge", name, help_text, fn, labelnames))
+
+    def counter(self, name: str, help_text: str, fn, labelnames: tuple = ()):
+        return self.register(Callback("counter", name, help_text, fn, labelnames))
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                lines.append(f"# {metric.name}: ошибка сбора: {_escape(e)}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+class LoopLagMonitor:
+    """Сторож event loop: просыпается каждые interval секунд и меряет, насколько опоздал.
+
+    Опоздание — время, на которое loop был занят чужим синхронным кодом. Хранится
+    последнее значение и максимум за окно (по умолчанию минута) — его и смотрит readiness.
+    """
+
+    def __init__(self, interval: float = 0.25, window: float = 60.0):
+        self.interval = interval
+        self.window = window
+        self.lag = 0.0
+        self.histogram = Histogram("bot_event_loop_lag_seconds", "Опоздание сторожа event loop",
+                                   buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+        self._recent = deque()  # (время, опоздание)
+        self._task = None
+
+    @property
+    def max_lag(self) -> float:
+        deadline = time.monotonic() - self.window
+        return max((lag for at, lag in self._recent if at >= deadline), default=0.0)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lag = max(0.0, now - started - self.interval)
+            self.histogram.observe(self.lag)
+            self._recent.append((now, self.lag))
+            while self._recent and self._recent[0][0] < now - self.window:
+                self._recent.popleft()
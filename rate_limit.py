@@ -0,0 +1,174 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import Counter
+from tracing import tracer
+
+# Приоритеты: ответы пользователям идут раньше фоновой рассылки/уведомлений
+INTERACTIVE = 0
+BULK = 1
+
+# Методы, которые не расходуют лимит сообщений
+UNLIMITED_ENDPOINTS = {"sendChatAction"}
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    delay = error.retry_after
+    return delay.total_seconds() if hasattr(delay, "total_seconds") else float(delay)
+
+
+class TokenBucket:
+    """Корзина токенов с резервированием: delay() забирает токен и говорит, сколько ждать."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def ready(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= 1 and self.blocked_until <= now
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+
+class BotRateLimiter(BaseRateLimiter):
+    """Лимитер исходящих запросов к Bot API: ~30 сообщений/с на бота и ~1/с на чат.
+
+    Подключается через ApplicationBuilder().rate_limiter(...). Запросы не отбрасываются,
+    а ждут в очереди; при общем ожидании интерактивные ответы обгоняют BULK
+    (rate_limit_args={"priority": BULK}). На RetryAfter чат (или весь бот) ставится
+    на паузу, а запрос повторяется сам.
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 max_retries: int = 3):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._pump = None
+        # счётчики для /timings и метрик
+        self.queued = 0
+        self.throttled = 0
+        self.throttle_delay = 0.0
+        self.retry_after = 0
+        self.api_errors = Counter("bot_api_errors_total", "Ошибки исходящих вызовов Bot API (включая 429)",
+                                  ("method", "error"))
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._pump is not None:
+            self._pump.cancel()
+            self._pump = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self.queued
+
+    def stats(self) -> str:
+        return (f"очередь={self.queue_depth} ожиданий={self.throttled} "
+                f"сумм. задержка={self.throttle_delay:.1f}с 429={self.retry_after}")
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10_000:
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle()}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _wait_global(self, priority: int):
+        if not self._heap and self._global.ready():
+            self._global.delay()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        await future
+
+    async def _run_pump(self):
+        while self._heap:
+            delay = self._global.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            while self._heap:
+                _, _, future = heapq.heappop(self._heap)
+                if not future.done():
+                    future.set_result(None)
+                    break
+
+    async def _acquire(self, chat_id, priority: int):
+        started = time.monotonic()
+        self.queued += 1
+        try:
+            if chat_id is not None:
+                delay = self._chat_bucket(chat_id).delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self._wait_global(priority)
+        finally:
+            self.queued -= 1
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            self.throttled += 1
+            self.throttle_delay += waited
+        return waited
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = (rate_limit_args or {}).get("priority", INTERACTIVE)
+        chat_id = data.get("chat_id")
+        limited = endpoint not in UNLIMITED_ENDPOINTS and endpoint.startswith(("send", "edit", "copy", "forward"))
+        # Спан на каждый вызов Bot API: общее время, из него ожидание лимитера и число попыток
+        with tracer.span("bot_api", method=endpoint, throttle_ms=0.0, attempts=0) as span:
+            for attempt in range(self.max_retries + 1):
+                span["attempts"] = attempt + 1
+                if limited:
+                    span["throttle_ms"] += round(await self._acquire(chat_id, priority) * 1000, 2)
+                try:
+                    return await callback(*args, **kwargs)
+                except RetryAfter as e:
+                    self.retry_after += 1
+                    self.api_errors.inc(method=endpoint, error="RetryAfter")
+                    if attempt == self.max_retries:
+                        raise
+                    delay = retry_after_seconds(e)
+                    if chat_id is not None:
+                        self._chat_bucket(chat_id).block(delay)
+                    else:
+                        self._global.block(delay)
+                    await asyncio.sleep(delay)
+                except Exception as e:
+                    self.api_errors.inc(method=endpoint, error=type(e).__name__)
+                    raise
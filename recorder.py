@@ -0,0 +1,141 @@
+import asyncio
+import gzip
+import hmac
+import json
+import logging
+import secrets
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Anonymizer:
+    """Обезличивает апдейт (dict из Update.to_dict()) с сохранением связей внутри записи.
+
+    id пользователей и личных чатов заменяются на стабильный хэш-номер (один человек —
+    один номер во всех апдейтах), имена, username, телефоны и свободный текст — на хэши.
+    Текст с @ (ник, который вводит пользователь) остаётся ником: @h<хэш>, иначе при
+    воспроизведении nickname_input отвергнет его и сценарий пойдёт по другой ветке.
+    Команды, callback_data, inline-запросы и id каналов (отрицательные) остаются как есть:
+    без них запись не воспроизвести.
+    """
+
+    HASHED = frozenset(("username", "first_name", "last_name", "phone_number", "vcard"))
+    IDS = frozenset(("id", "user_id"))
+    TEXT = frozenset(("text", "caption"))
+
+    def __init__(self, salt: str = ""):
+        self.salt = (salt or secrets.token_hex(16)).encode("utf-8")
+
+    def _hash(self, value) -> str:
+        return hmac.new(self.salt, str(value).encode("utf-8"), "sha256").hexdigest()[:12]
+
+    def user_id(self, value: int) -> int:
+        return int(self._hash(value), 16) % 10**12 + 1
+
+    def _text(self, value: str) -> str:
+        nick = value.strip()
+        if nick.startswith("@"):
+            # одиночный @ оставляем: бот отвергает его так же, как при записи
+            return "@h" + self._hash(nick) if len(nick) > 1 else nick
+        return "h" + self._hash(value)
+
+    def __call__(self, obj):
+        if isinstance(obj, list):
+            return [self(item) for item in obj]
+        if not isinstance(obj, dict):
+            return obj
+        out = {}
+        for key, value in obj.items():
+            if key in self.IDS and type(value) is int and value > 0:
+                out[key] = self.user_id(value)
+            elif key in self.HASHED and isinstance(value, str):
+                out[key] = "h" + self._hash(value)
+            elif key in self.TEXT and isinstance(value, str) and not value.startswith("/"):
+                out[key] = self._text(value)
+            else:
+                out[key] = self(value)
+        return out
+
+
+class UpdateRecorder:
+    """Запись входящих апдейтов с временем прихода — для bench/replay.py.
+
+    Строка JSONL: {"ts": unix-время, "update": обезличенный апдейт}. Путь на .gz — сжатый файл.
+    Апдейт обезличивается сразу, а на диск строки уходят пачкой из потока раз в flush_interval,
+    чтобы event loop не ждал диск. Если запись не успевает, лишнее отбрасывается и считается.
+    """
+
+    def __init__(self, path: str, salt: str = "", flush_interval: float = 1.0, max_buffer: int = 10_000):
+        self.path = path
+        self.anonymize = Anonymizer(salt)
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer = []
+        self._task = None
+        self.recorded = 0
+        self.dropped = 0
+
+    def record(self, update):
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        try:
+            data = self.anonymize(update.to_dict())
+        except Exception as e:
+            log.debug("Апдейт не записан", extra={"error": str(e)})
+            return
+        self._buffer.append(json.dumps({"ts": round(time.time(), 3), "update": data},
+                                       ensure_ascii=False, separators=(",", ":")))
+
+    def _write(self, lines: list):
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with opener(self.path, "at", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    async def flush(self):
+        lines, self._buffer = self._buffer, []
+        if not lines:
+            return
+        try:
+            await asyncio.to_thread(self._write, lines)
+            self.recorded += len(lines)
+        except OSError as e:
+            self.dropped += len(lines)
+            log.warning("Ошибка записи апдейтов", extra={"path": self.path, "error": str(e)})
+
+    async def start(self):
+        if self._task is None:
+            log.info("Запись апдейтов включена", extra={"path": self.path})
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        log.info("Запись апдейтов остановлена",
+                 extra={"path": self.path, "recorded": self.recorded, "dropped": self.dropped})
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+def read_records(paths: list) -> list:
+    """[(ts, апдейт)] из одного или нескольких файлов (например, по файлу на воркер), по времени прихода."""
+    records = []
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    records.append((entry["ts"], entry["update"]))
+    records.sort(key=lambda record: record[0])
+    return records
@@ -0,0 +1,113 @@
+import csv
+import sqlite3
+
+EXPORT_COLUMNS = ("timestamp", "role", "action", "subject", "class", "nickname", "phone", "user_id")
+
+
+class RegistrationStore:
+    """Локальная копия заявок (то же, что уходит в Google Sheets) для выборок без API таблиц.
+
+    Время хранится строкой "YYYY-MM-DD HH:MM:SS" (МСК), поэтому диапазоны сравниваются как строки.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        # add() вызывается из хендлера; в WAL коммит не ждёт fsync, а /stats и /export читают параллельно
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS registrations ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " timestamp TEXT NOT NULL, role TEXT, action TEXT, subject TEXT, class TEXT,"
+            " nickname TEXT, phone TEXT, user_id INTEGER NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS registrations_subject_class ON registrations (subject, class)")
+        for column in ("timestamp", "subject", "class", "role", "action"):
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS registrations_{column} ON registrations ({column})")
+        self.conn.commit()
+
+    def add(self, record: dict):
+        self.conn.execute(
+            "INSERT INTO registrations (timestamp, role, action, subject, class, nickname, phone, user_id)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (record.get("timestamp", "-"), record.get("role", "-"), record.get("action", "-"),
+             record.get("subject", "-"), record.get("class", "-"), record.get("nickname", "-"),
+             record.get("phone", "-"), record["user_id"]),
+        )
+        self.conn.commit()
+
+    def recipients(self, subject: str, klass: str = None, action: str = "register") -> list:
+        """user_id всех, кто записывался на предмет (и класс, если указан)."""
+        query = "SELECT DISTINCT user_id FROM registrations WHERE subject = ? AND action = ?"
+        params = [subject, action]
+        if klass:
+            query += " AND class = ?"
+            params.append(klass)
+        return [row[0] for row in self.conn.execute(query + " ORDER BY user_id", params)]
+
+    @staticmethod
+    def _where(since: str = None, subject: str = None, action: str = None):
+        clauses, params = [], []
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if subject:
+            clauses.append("subject = ?")
+            params.append(subject)
+        if action:
+            clauses.append("action = ?")
+            params.append(action)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def stats(self, since: str = None, subject: str = None, action: str = None) -> dict:
+        """Счётчики за период: всего, в разрезе действия, предмета, класса и роли,
+        а также предмет × класс и действие × класс / действие × предмет.
+
+        Как и export_csv, рассчитан на вызов из потока и открывает своё соединение.
+        """
+        where, params = self._where(since, subject, action)
+        conn = sqlite3.connect(self.path)
+        try:
+            result = {"total": conn.execute(f"SELECT COUNT(*) FROM registrations{where}", params).fetchone()[0]}
+            for column in ("action", "subject", "class", "role"):
+                result[column] = conn.execute(
+                    f"SELECT {column}, COUNT(*) AS n FROM registrations{where} GROUP BY {column} ORDER BY n DESC",
+                    params,
+                ).fetchall()
+            result["subject_class"] = conn.execute(
+                f"SELECT subject, class, COUNT(*) AS n FROM registrations{where}"
+                " GROUP BY subject, class ORDER BY n DESC LIMIT 15",
+                params,
+            ).fetchall()
+            for column in ("class", "subject"):
+                result[f"action_{column}"] = conn.execute(
+                    f"SELECT action, {column}, COUNT(*) AS n FROM registrations{where}"
+                    f" GROUP BY action, {column} ORDER BY action, n DESC",
+                    params,
+                ).fetchall()
+        finally:
+            conn.close()
+        return result
+
+    def export_csv(self, out_path: str, since: str = None, subject: str = None, action: str = None) -> int:
+        """Пишет CSV построчно курсором, не загружая всё в память.
+
+        Выполняется в отдельном потоке, поэтому открывает своё соединение.
+        """
+        where, params = self._where(since, subject, action)
+        conn = sqlite3.connect(self.path)
+        count = 0
+        try:
+            with open(out_path, "w", encoding="utf-8-sig", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(EXPORT_COLUMNS)
+                cursor = conn.execute(
+                    f"SELECT {', '.join(EXPORT_COLUMNS)} FROM registrations{where} ORDER BY timestamp", params
+                )
+                for row in cursor:
+                    writer.writerow(row)
+                    count += 1
+        finally:
+            conn.close()
+        return count
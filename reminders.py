@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import sqlite3
+import time
+
+from telegram import Bot
+from telegram.error import Forbidden
+
+from rate_limit import BULK
+
+log = logging.getLogger(__name__)
+
+PENDING, SENDING, SENT, FAILED, BLOCKED, CANCELLED = "pending", "sending", "sent", "failed", "blocked", "cancelled"
+
+
+class TimingWheel:
+    """Иерархическое колесо таймеров: вставка и отмена за O(1), сколько бы записей ни ждало.
+
+    Время — целые тики (секунды). Уровень l — 64 слота по 64**l тиков. Запись попадает
+    на уровень по старшим отличающимся битам срока и текущего тика; когда младший уровень
+    проходит круг, слот старшего «осыпается» вниз. Что дальше 64**levels тиков — в overflow.
+    """
+
+    BITS = 6
+    SLOTS = 1 << BITS
+
+    def __init__(self, now: int, levels: int = 4):
+        self.now = now
+        self.levels = levels
+        self._slots = [[{} for _ in range(self.SLOTS)] for _ in range(levels)]
+        self._overflow = {}
+        self._where = {}  # ключ -> слот (dict), где лежит запись
+        self._due = {}    # сроки в прошлом: сработают на ближайшем тике
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, key) -> bool:
+        return key in self._where
+
+    def _slot_for(self, due: int) -> dict:
+        if due <= self.now:
+            return self._due
+        for level in range(self.levels):
+            shift = self.BITS * (level + 1)
+            if due >> shift == self.now >> shift:
+                return self._slots[level][(due >> (self.BITS * level)) & (self.SLOTS - 1)]
+        return self._overflow
+
+    def insert(self, key, due: int, value=None):
+        self.cancel(key)
+        slot = self._slot_for(due)
+        slot[key] = (due, value)
+        self._where[key] = slot
+
+    def cancel(self, key) -> bool:
+        slot = self._where.pop(key, None)
+        if slot is None:
+            return False
+        del slot[key]
+        return True
+
+    def _cascade(self, slot: dict):
+        entries = list(slot.items())
+        slot.clear()
+        for key, (due, value) in entries:
+            del self._where[key]
+            self.insert(key, due, value)
+
+    def advance(self, now: int) -> list:
+        """Доводит колесо до тика now и возвращает сработавшие (ключ, срок, значение)."""
+        fired = []
+
+        def take(slot: dict):
+            for key, (due, value) in slot.items():
+                del self._where[key]
+                fired.append((key, due, value))
+            slot.clear()
+
+        take(self._due)
+        while self.now < now:
+            self.now += 1
+            for level in range(self.levels - 1, 0, -1):
+                if self.now & ((1 << (self.BITS * level)) - 1) == 0:
+                    if level == self.levels - 1 and self.now & ((1 << (self.BITS * self.levels)) - 1) == 0:
+                        self._cascade(self._overflow)
+                    self._cascade(self._slots[level][(self.now >> (self.BITS * level)) & (self.SLOTS - 1)])
+            take(self._slots[0][self.now & (self.SLOTS - 1)])
+            take(self._due)
+        return fired
+
+
+class ReminderScheduler:
+    """Напоминания о занятиях записавшимся (по предмету и классу).
+
+    Занятия и напоминания лежат в SQLite; при старте ожидающие напоминания загружаются
+    в колесо таймеров. Сработавшие за тик напоминания отправляются пачками через общий
+    лимитер (BULK), а не по одному. Перед отправкой состояние перечитывается из базы,
+    поэтому отмена или отправка другим процессом не приводят к дублям.
+    """
+
+    def __init__(self, path: str, lead: float = 3600.0, batch_size: int = 30, sync_interval: float = 30.0):
+        self.lead = lead
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        self.wheel = TimingWheel(int(time.time()))
+        self._lessons = {}  # lesson_id -> текст напоминания
+        self._loaded_id = 0
+        self._bot = None
+        self._task = None
+        self._sender = None
+        self._outbox = asyncio.Queue()
+        self.sent = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")  # коммиты из event loop — без fsync на каждый
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS lessons ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, subject TEXT NOT NULL, class TEXT,"
+            " starts_at REAL NOT NULL, remind_at REAL NOT NULL, text TEXT NOT NULL, cancelled INTEGER DEFAULT 0);"
+            "CREATE TABLE IF NOT EXISTS reminders ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, lesson_id INTEGER NOT NULL, user_id INTEGER NOT NULL,"
+            " due_at REAL NOT NULL, state TEXT NOT NULL, UNIQUE (lesson_id, user_id));"
+            "CREATE INDEX IF NOT EXISTS reminders_state_due ON reminders (state, due_at);"
+            "CREATE INDEX IF NOT EXISTS lessons_subject_class ON lessons (subject, class, remind_at);"
+        )
+        self.conn.commit()
+
+    # --- планирование ---
+
+    def add_lesson(self, subject: str, klass: str, starts_at: float, text: str, user_ids: list) -> tuple:
+        """Занятие и напоминание каждому получателю за lead секунд. Возвращает (id, число напоминаний)."""
+        remind_at = starts_at - self.lead
+        cur = self.conn.execute(
+            "INSERT INTO lessons (subject, class, starts_at, remind_at, text) VALUES (?, ?, ?, ?, ?)",
+            (subject, klass, starts_at, remind_at, text),
+        )
+        lesson_id = cur.lastrowid
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO reminders (lesson_id, user_id, due_at, state) VALUES (?, ?, ?, ?)",
+            [(lesson_id, user_id, remind_at, PENDING) for user_id in user_ids],
+        )
+        self.conn.commit()
+        self._refresh()
+        return lesson_id, len(user_ids)
+
+    def add_user(self, user_id: int, subject: str, klass: str) -> int:
+        """Новый записавшийся получает напоминания о ещё не начавшихся занятиях своей группы."""
+        lessons = self.conn.execute(
+            "SELECT id, remind_at FROM lessons WHERE cancelled = 0 AND subject = ?"
+            " AND (class IS NULL OR class = ?) AND starts_at > ?",
+            (subject, klass, time.time()),
+        ).fetchall()
+        if not lessons:
+            return 0  # обычный случай — занятий не назначено, писать нечего
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO reminders (lesson_id, user_id, due_at, state) VALUES (?, ?, ?, ?)",
+            [(lesson_id, user_id, remind_at, PENDING) for lesson_id, remind_at in lessons],
+        )
+        self.conn.commit()
+        self._refresh()
+        return len(lessons)
+
+    def cancel_lesson(self, lesson_id: int) -> int:
+        ids = [row[0] for row in self.conn.execute(
+            "SELECT id FROM reminders WHERE lesson_id = ? AND state = ?", (lesson_id, PENDING))]
+        self.conn.execute("UPDATE lessons SET cancelled = 1 WHERE id = ?", (lesson_id,))
+        self.conn.execute("UPDATE reminders SET state = ? WHERE lesson_id = ? AND state = ?",
+                          (CANCELLED, lesson_id, PENDING))
+        self.conn.commit()
+        for reminder_id in ids:
+            self.wheel.cancel(reminder_id)
+        return len(ids)
+
+    def upcoming(self) -> list:
+        """(id, предмет, класс, начало, ожидающих, отправлено) для незавершённых занятий."""
+        return self.conn.execute(
+            "SELECT l.id, l.subject, l.class, l.starts_at,"
+            " SUM(r.state = 'pending'), SUM(r.state = 'sent')"
+            " FROM lessons l LEFT JOIN reminders r ON r.lesson_id = l.id"
+            " WHERE l.cancelled = 0 AND l.starts_at > ? GROUP BY l.id ORDER BY l.starts_at",
+            (time.time(),),
+        ).fetchall()
+
+    def _refresh(self):
+        # в колесо грузит только запущенный планировщик; остальные воркеры лишь пишут в базу,
+        # ведущий подхватит новое при очередной синхронизации
+        if self._task is not None:
+            self._load()
+
+    def _load(self):
+        """Догружает в колесо новые ожидающие напоминания (в т.ч. созданные другими воркерами)."""
+        rows = self.conn.execute(
+            "SELECT r.id, r.lesson_id, r.user_id, r.due_at, l.text FROM reminders r"
+            " JOIN lessons l ON l.id = r.lesson_id WHERE r.id > ? AND r.state = ? ORDER BY r.id",
+            (self._loaded_id, PENDING),
+        ).fetchall()
+        for reminder_id, lesson_id, user_id, due_at, text in rows:
+            self._lessons[lesson_id] = text
+            self.wheel.insert(reminder_id, int(due_at), (lesson_id, user_id))
+            self._loaded_id = reminder_id
+
+    # --- фоновая работа ---
+
+    async def start(self, bot: Bot):
+        self._bot = bot
+        self._load()
+        log.info("Напоминания загружены", extra={"pending": len(self.wheel)})
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            self._sender = asyncio.create_task(self._send_loop())
+
+    async def stop(self):
+        for task in (self._task, self._sender):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._sender = None
+
+    async def _run(self):
+        last_sync = time.monotonic()
+        while True:
+            await asyncio.sleep(1 - time.time() % 1)
+            if time.monotonic() - last_sync >= self.sync_interval:
+                self._load()
+                last_sync = time.monotonic()
+            fired = self.wheel.advance(int(time.time()))
+            for start in range(0, len(fired), self.batch_size):
+                self._outbox.put_nowait(fired[start:start + self.batch_size])
+
+    def _claim(self, batch: list) -> list:
+        """Оставляет только ещё ожидающие напоминания и помечает их sending."""
+        ids = [key for key, _, _ in batch]
+        marks = ",".join("?" * len(ids))
+        pending = {row[0] for row in self.conn.execute(
+            f"SELECT id FROM reminders WHERE state = ? AND id IN ({marks})", (PENDING, *ids))}
+        self.conn.executemany("UPDATE reminders SET state = ? WHERE id = ?", [(SENDING, i) for i in pending])
+        self.conn.commit()
+        return [item for item in batch if item[0] in pending]
+
+    async def _send_one(self, reminder_id: int, lesson_id: int, user_id: int) -> tuple:
+        try:
+            await self._bot.send_message(chat_id=user_id, text=self._lessons[lesson_id],
+                                         rate_limit_args={"priority": BULK})
+            return SENT, reminder_id
+        except Forbidden:
+            return BLOCKED, reminder_id
+        except Exception as e:
+            log.warning("Ошибка отправки напоминания", extra={"user_id": user_id, "error": str(e)})
+            return FAILED, reminder_id
+
+    async def _send_loop(self):
+        while True:
+            batch = self._claim(await self._outbox.get())
+            if not batch:
+                continue
+            results = await asyncio.gather(*(
+                self._send_one(key, lesson_id, user_id) for key, _, (lesson_id, user_id) in batch
+            ))
+            self.conn.executemany("UPDATE reminders SET state = ? WHERE id = ?", results)
+            self.conn.commit()
+            self.sent += sum(1 for state, _ in results if state == SENT)
@@ -0,0 +1,71 @@
+import re
+from collections import defaultdict
+
+_WORD = re.compile(r"[^\W_]+")
+_EXTENSION = re.compile(r"\.\w{2,4}$")
+
+
+def words(text: str) -> list:
+    """Слова в нижнем регистре, ё = е, без расширения файла."""
+    return _WORD.findall(_EXTENSION.sub("", text).lower().replace("ё", "е"))
+
+
+def trigrams(word: str) -> set:
+    # края слова помечаем, чтобы короткие слова и начала слов тоже давали триграммы
+    padded = f"_{word}_"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Поиск материалов по названию, предмету и имени файла.
+
+    Строится целиком при изменении каталога, запросы обслуживаются из словарей в памяти.
+    Каждое слово запроса ищется сначала как префикс слова материала; если таких нет —
+    по триграммам (опечатки, середина слова). Материал должен подойти под все слова запроса.
+    """
+
+    MIN_SIMILARITY = 0.5  # доля триграмм слова запроса, которые должны совпасть
+
+    def __init__(self, materials: list):
+        self._materials = list(materials)  # порядок — ранг при равной релевантности
+        self._prefixes = defaultdict(set)  # префикс слова -> номера материалов
+        self._trigrams = defaultdict(set)  # триграмма -> номера материалов
+        for index, material in enumerate(self._materials):
+            name = material.path.replace("\\", "/").rsplit("/", 1)[-1]
+            for word in set(words(f"{material.title} {material.subject} {name}")):
+                for end in range(1, len(word) + 1):
+                    self._prefixes[word[:end]].add(index)
+                for gram in trigrams(word):
+                    self._trigrams[gram].add(index)
+
+    def __len__(self) -> int:
+        return len(self._materials)
+
+    def _match(self, word: str) -> dict:
+        """номер материала -> вес совпадения одного слова запроса."""
+        exact = self._prefixes.get(word)
+        if exact:
+            return dict.fromkeys(exact, 1.0)
+        grams = trigrams(word)
+        hits = defaultdict(int)
+        for gram in grams:
+            for index in self._trigrams.get(gram, ()):
+                hits[index] += 1
+        return {index: n / len(grams) for index, n in hits.items() if n / len(grams) >= self.MIN_SIMILARITY}
+
+    def search(self, query: str, limit: int = 50) -> list:
+        """Материалы по убыванию релевантности; пустой запрос — первые limit по порядку каталога."""
+        query_words = words(query)
+        if not query_words:
+            return self._materials[:limit]
+        scores = None
+        for word in query_words:
+            matched = self._match(word)
+            if scores is None:
+                scores = matched
+            else:
+                scores = {index: score + matched[index] for index, score in scores.items() if index in matched}
+            if not scores:
+                return []
+        best = sorted(scores, key=lambda index: (-scores[index], index))[:limit]
+        return [self._materials[index] for index in best]
@@ -0,0 +1,294 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+from state import StateError, state_backend
+
+log = logging.getLogger(__name__)
+
+
+class Session:
+    """Состояние сценария одного пользователя.
+
+    Фиксированный набор полей (__slots__) вместо свободного dict; доступ по ключам
+    оставлен dict-подобным, чтобы хендлеры писали session["step"] как раньше.
+    """
+
+    # ключ в хендлерах -> атрибут
+    FIELDS = {
+        "user_id": "user_id",
+        "step": "step",
+        "role": "role",
+        "action": "action",
+        "subject": "subject",
+        "class": "klass",
+        "nickname": "nickname",
+        "phone": "phone",
+        "next_need_phone": "next_need_phone",
+    }
+    __slots__ = tuple(FIELDS.values()) + ("updated_at", "_store")
+
+    def __init__(self, store=None, **values):
+        for attr in self.FIELDS.values():
+            setattr(self, attr, None)
+        self._store = store
+        self.updated_at = time.time()
+        for key, value in values.items():
+            setattr(self, self._attr(key), value)
+
+    def _attr(self, key: str) -> str:
+        try:
+            return self.FIELDS[key]
+        except KeyError:
+            raise KeyError(f"Неизвестное поле сессии: {key}") from None
+
+    def __getitem__(self, key):
+        value = getattr(self, self._attr(key))
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        setattr(self, self._attr(key), value)
+        self.touch()
+
+    def get(self, key, default=None):
+        value = getattr(self, self._attr(key))
+        return default if value is None else value
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        setattr(self, self._attr(key), None)
+        self.touch()
+        return value
+
+    def copy(self) -> dict:
+        return {key: getattr(self, attr) for key, attr in self.FIELDS.items() if getattr(self, attr) is not None}
+
+    def touch(self):
+        self.updated_at = time.time()
+        if self._store is not None and self.user_id is not None:
+            self._store.mark_dirty(self.user_id)
+
+
+class SessionStore:
+    """Хранилище сессий: LRU с ограничением по памяти, TTL для брошенных сценариев
+    и отложенная запись (write-behind) в SQLite, чтобы после перезапуска продолжить с того же шага.
+
+    С общим бэкендом (несколько воркеров) сессии пишутся туда же отложенно, а читаются
+    заранее через preload() — процессор апдейтов вызывает его до хендлера, поэтому
+    синхронный доступ к сессии в хендлерах остаётся прежним.
+
+    Сессии может не оказаться и посреди сценария (истёк ttl, бэкенд не ответил при preload):
+    get() тогда возвращает None, и хендлеры просят пользователя начать с /start.
+    """
+
+    KEY = "session:{}"
+
+    def __init__(self, path: str, max_size: int = 50_000, ttl: float = 24 * 3600, flush_interval: float = 5.0,
+                 backend=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.backend = backend
+        self._sessions = OrderedDict()
+        self._dirty = set()
+        self._evicted = {}   # вытесненные несохранённые сессии (режим бэкенда) до ближайшего flush
+        self._deleted = set()
+        self._task = None
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        self.conn.commit()
+
+    # --- dict-подобный интерфейс для хендлеров ---
+
+    def __setitem__(self, user_id: int, values: dict):
+        values = dict(values)
+        values.setdefault("user_id", user_id)
+        self._put(Session(self, **values))
+        self.mark_dirty(user_id)
+
+    def __getitem__(self, user_id: int) -> Session:
+        session = self.get(user_id)
+        if session is None:
+            raise KeyError(user_id)
+        return session
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, user_id: int, default=None):
+        session = self._sessions.get(user_id)
+        if session is None:
+            session = self._load(user_id)
+            if session is None:
+                return default
+            self._put(session)
+        elif time.time() - session.updated_at > self.ttl:
+            self.discard(user_id)
+            return default
+        else:
+            self._sessions.move_to_end(user_id)
+        return session
+
+    def values(self):
+        return list(self._sessions.values())
+
+    def discard(self, user_id: int):
+        self._sessions.pop(user_id, None)
+        self._dirty.discard(user_id)
+        if self.backend is not None:
+            self._evicted.pop(user_id, None)
+            self._deleted.add(user_id)
+            return
+        self.conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+        self.conn.commit()
+
+    def mark_dirty(self, user_id: int):
+        self._dirty.add(user_id)
+        # новая сессия после discard (например, /start после истечения): удалять из бэкенда уже нечего
+        self._deleted.discard(user_id)
+
+    # --- память и диск ---
+
+    def _put(self, session: Session):
+        self._sessions[session.user_id] = session
+        self._sessions.move_to_end(session.user_id)
+        while len(self._sessions) > self.max_size:
+            user_id, evicted = self._sessions.popitem(last=False)
+            if user_id in self._dirty:
+                self._dirty.discard(user_id)
+                if self.backend is not None:
+                    self._evicted[user_id] = evicted
+                else:
+                    self._write([evicted])
+
+    async def preload(self, user_id: int):
+        """Подтягивает сессию из общего бэкенда, если её нет в памяти процесса."""
+        if self.backend is None or user_id in self._sessions:
+            return
+        session = self._evicted.pop(user_id, None)
+        if session is None and user_id not in self._deleted:
+            try:
+                raw = await self.backend.get(self.KEY.format(user_id))
+            except StateError as e:
+                log.warning("Бэкенд сессий недоступен, начинаем с пустой сессии", extra={"user_id": user_id, "error": str(e)})
+                return
+            if raw is None or user_id in self._sessions:
+                return
+            data = json.loads(raw)
+            session = Session(self, **data["values"])
+            session.updated_at = data["updated_at"]
+        elif session is not None:
+            self._dirty.add(user_id)  # вытесненная сессия ещё не записана в бэкенд
+        if session is not None and time.time() - session.updated_at <= self.ttl:
+            self._put(session)
+
+    def _load(self, user_id: int):
+        if self.backend is not None:
+            return None  # загружено заранее через preload()
+        row = self.conn.execute("SELECT data, updated_at FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        session = Session(self, **json.loads(row[0]))
+        session.updated_at = row[1]
+        return session
+
+    def _write(self, sessions: list):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?)",
+            [(s.user_id, json.dumps(s.copy(), ensure_ascii=False), s.updated_at) for s in sessions],
+        )
+        self.conn.commit()
+
+    def flush(self):
+        """Пишет изменённые сессии на диск и чистит брошенные сценарии."""
+        dirty = [self._sessions[u] for u in self._dirty if u in self._sessions]
+        self._dirty.clear()
+        if dirty:
+            self._write(dirty)
+        deadline = time.time() - self.ttl
+        while self._sessions:
+            user_id, oldest = next(iter(self._sessions.items()))
+            if oldest.updated_at > deadline:
+                break
+            self._sessions.popitem(last=False)
+        self.conn.execute("DELETE FROM sessions WHERE updated_at < ?", (deadline,))
+        self.conn.commit()
+
+    async def save(self):
+        """flush() для SQLite или запись изменённых сессий в общий бэкенд."""
+        if self.backend is None:
+            self.flush()
+            return
+        dirty = [self._sessions[u] for u in self._dirty if u in self._sessions] + list(self._evicted.values())
+        deleted = list(self._deleted)
+        self._dirty.clear()
+        self._evicted.clear()
+        self._deleted.clear()
+        try:
+            # сначала удаления, потом запись: ключ не может пропасть после записи новой сессии
+            if deleted:
+                await self.backend.delete(*(self.KEY.format(u) for u in deleted))
+            if dirty:
+                await self.backend.set_many({
+                    self.KEY.format(s.user_id): json.dumps({"values": s.copy(), "updated_at": s.updated_at},
+                                                           ensure_ascii=False)
+                    for s in dirty
+                }, ttl=self.ttl)
+        except StateError:
+            # вернём в очередь до следующей попытки
+            for session in dirty:
+                if session.user_id in self._sessions:
+                    self._dirty.add(session.user_id)
+                else:
+                    self._evicted[session.user_id] = session
+            self._deleted.update(u for u in deleted if u not in self._sessions)
+            raise
+        deadline = time.time() - self.ttl
+        while self._sessions:
+            user_id, oldest = next(iter(self._sessions.items()))
+            if oldest.updated_at > deadline:
+                break
+            self._sessions.popitem(last=False)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.save()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.save()
+            except Exception:
+                log.exception("Ошибка сохранения сессий")
+
+
+# Общее хранилище для bot.py и materials.py
+users_data = SessionStore(
+    os.getenv("SESSIONS_FILE", "sessions.db"),
+    max_size=int(os.getenv("SESSIONS_MAX", "50000")),
+    ttl=float(os.getenv("SESSIONS_TTL", str(24 * 3600))),
+    backend=state_backend,
+)
@@ -0,0 +1,199 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from metrics import Counter, Histogram
+from tracing import tracer
+
+log = logging.getLogger(__name__)
+
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+
+class SheetsClient:
+    """Долгоживущий клиент Google Sheets.
+
+    Авторизуемся и открываем таблицу один раз, а не на каждую строку.
+    Клиент пересоздаётся лениво: по истечении max_age или после ошибки (invalidate).
+    """
+
+    def __init__(self, credentials_file: str, sheet_name: str, max_age: float = 45 * 60):
+        self.credentials_file = credentials_file
+        self.sheet_name = sheet_name
+        self.max_age = max_age
+        self._sheet = None
+        self._opened_at = 0.0
+
+    def worksheet(self):
+        if self._sheet is None or time.monotonic() - self._opened_at > self.max_age:
+            # тяжёлые библиотеки грузим при первой записи/прогреве, а не при старте процесса
+            import gspread
+            from oauth2client.service_account import ServiceAccountCredentials
+
+            creds = ServiceAccountCredentials.from_json_keyfile_name(self.credentials_file, SCOPE)
+            client = gspread.authorize(creds)
+            self._sheet = client.open(self.sheet_name).sheet1
+            self._opened_at = time.monotonic()
+        return self._sheet
+
+    def invalidate(self):
+        self._sheet = None
+
+    def append_rows(self, rows: list):
+        self.worksheet().append_rows(rows)
+
+
+def worker_spools(path: str, first: int = 0) -> list:
+    """Файлы спула воркеров рядом с path (sheets_spool.<i>.db) с номером от first, по номеру."""
+    root, ext = os.path.splitext(path)
+    found = []
+    for name in glob.glob(f"{glob.escape(root)}.*{ext}"):
+        index = name[len(root) + 1:len(name) - len(ext)]
+        if index.isdigit() and int(index) >= first:
+            found.append((int(index), name))
+    return [name for _, name in sorted(found)]
+
+
+class SheetsSpool:
+    """Локальная очередь строк (SQLite). Строка удаляется только после успешной записи в таблицу.
+
+    Число строк считается один раз при открытии и дальше ведётся в памяти: COUNT(*)
+    на каждую строку дорожал бы вместе с хвостом, то есть как раз когда Sheets лежит.
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        # строка коммитится из event loop на каждую заявку; WAL + NORMAL — без fsync на коммит,
+        # при падении процесса (не питания) строки сохраняются
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS rows (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)")
+        self.conn.commit()
+        self._count = self.conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def add(self, row: list) -> int:
+        cur = self.conn.execute("INSERT INTO rows (payload) VALUES (?)", (json.dumps(row, ensure_ascii=False),))
+        self.conn.commit()
+        self._count += 1
+        return cur.lastrowid
+
+    def peek(self, limit: int) -> list:
+        cur = self.conn.execute("SELECT id, payload FROM rows ORDER BY id LIMIT ?", (limit,))
+        return [(row_id, json.loads(payload)) for row_id, payload in cur.fetchall()]
+
+    def ack(self, ids: list):
+        cur = self.conn.executemany("DELETE FROM rows WHERE id = ?", [(i,) for i in ids])
+        self.conn.commit()
+        self._count -= cur.rowcount
+
+    def count(self) -> int:
+        return self._count
+
+    def close(self):
+        self.conn.close()
+
+
+class SheetsWriter:
+    """Фоновая запись в Google Sheets пачками через append_rows.
+
+    Строки сначала попадают в спул, затем сбрасываются по размеру пачки (batch_size)
+    или по времени (flush_interval). При ошибке — повтор с экспоненциальной задержкой.
+    При старте досылается всё, что осталось в спуле с прошлого запуска.
+    """
+
+    def __init__(self, client: SheetsClient, spool: SheetsSpool, batch_size: int = 50,
+                 flush_interval: float = 2.0, max_backoff: float = 60.0):
+        self.client = client
+        self.spool = spool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self._backoff = 0.0
+        self._wake = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._task = None
+        self._traces = {}  # id строки в спуле -> trace_id апдейта, который её добавил
+        self.write_seconds = Histogram("bot_sheets_write_seconds", "Время записи пачки в Google Sheets",
+                                       buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+        self.write_errors = Counter("bot_sheets_write_errors_total", "Неудачные записи пачек в Google Sheets")
+
+    def enqueue(self, row: list):
+        with tracer.span("sheets.spool"):
+            row_id = self.spool.add(row)
+        pending = self.spool.count()
+        trace_id = tracer.current_id()
+        if trace_id:
+            self._traces[row_id] = trace_id
+        if pending >= self.batch_size:
+            self._wake.set()
+
+    async def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0):
+        """Останавливаем цикл и пытаемся дослать спул. Недосланное останется на диске.
+
+        Цикл не отменяем посреди записи: append_rows в потоке всё равно дойдёт до таблицы,
+        а неподтверждённая пачка ушла бы второй раз. Цикл сам дописывает текущую пачку,
+        делает последний сброс и выходит; отменяем его только по таймауту.
+        """
+        self._stopping.set()
+        self._wake.set()
+        task, self._task = self._task, None
+        try:
+            if task is not None:
+                await asyncio.wait_for(asyncio.shield(task), timeout)
+            else:
+                await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            if task is not None:
+                task.cancel()
+            log.warning("Не успели дослать строки при остановке", extra={"pending": self.spool.count()})
+
+    async def flush(self) -> bool:
+        """Сбрасывает спул пачками. False — если запись упала и надо подождать."""
+        while True:
+            batch = self.spool.peek(self.batch_size)
+            if not batch:
+                return True
+            # links — апдейты, чьи строки ушли этой пачкой: по ним медленная запись находится из трассы
+            links = [self._traces[row_id] for row_id, _ in batch if row_id in self._traces]
+            started = time.perf_counter()
+            try:
+                with tracer.span("sheets.append_rows", rows=len(batch), links=links):
+                    await asyncio.to_thread(self.client.append_rows, [row for _, row in batch])
+            except Exception as e:
+                self.write_errors.inc()
+                self.client.invalidate()
+                self._backoff = min(max(self._backoff * 2, 1.0), self.max_backoff)
+                log.warning("Ошибка записи в Google Sheets, повтор позже",
+                            extra={"rows": len(batch), "backoff_s": self._backoff, "error": str(e)})
+                return False
+            self.write_seconds.observe(time.perf_counter() - started)
+            self.spool.ack([row_id for row_id, _ in batch])
+            for row_id, _ in batch:
+                self._traces.pop(row_id, None)
+            self._backoff = 0.0
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            if not await self.flush():
+                # после ошибки ждём полный backoff, даже если пришли новые строки (но не при остановке)
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self._backoff)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+        # последний сброс — уже после того, как текущая пачка записана и подтверждена
+        await self.flush()
@@ -0,0 +1,37 @@
+import time
+from contextlib import contextmanager
+
+# Отсчёт от импорта этого модуля — bot.py импортирует его первым
+PROCESS_START = time.perf_counter()
+
+
+class StartupTimer:
+    """Время фаз запуска: от импортов до окончания фонового прогрева."""
+
+    def __init__(self, start: float):
+        self._last = start
+        self._start = start
+        self.phases = []
+
+    def mark(self, name: str):
+        """Фаза, закончившаяся сейчас (длится с предыдущей отметки)."""
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    @contextmanager
+    def phase(self, name: str):
+        """Отдельно замеряемая фаза (например, шаг фонового прогрева)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def report(self) -> str:
+        total = time.perf_counter() - self._start
+        lines = [f"  {name:<28}{seconds * 1000:>8.0f} мс" for name, seconds in self.phases]
+        return "[Startup] Фазы запуска:\n" + "\n".join(lines) + f"\n  {'всего с начала':<28}{total * 1000:>8.0f} мс"
+
+
+startup_timer = StartupTimer(PROCESS_START)
@@ -0,0 +1,215 @@
+import asyncio
+import os
+import time
+from urllib.parse import urlsplit
+
+from tracing import tracer
+
+
+class StateError(Exception):
+    pass
+
+
+class MemoryBackend:
+    """Общее состояние в памяти процесса: для одного воркера и как эталон поведения.
+
+    Интерфейс у всех бэкендов одинаковый и асинхронный; значения — строки
+    (сериализацией занимается вызывающий код). ttl — в секундах, None — без срока.
+    """
+
+    def __init__(self):
+        self._values = {}  # ключ -> (значение, истекает_в | None)
+        self._lists = {}
+
+    def _alive(self, key: str):
+        entry = self._values.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self._values[key]
+            return None
+        return entry
+
+    async def get(self, key: str):
+        entry = self._alive(key)
+        return entry[0] if entry else None
+
+    async def set(self, key: str, value: str, ttl: float = None):
+        self._values[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    async def set_many(self, items: dict, ttl: float = None):
+        for key, value in items.items():
+            await self.set(key, value, ttl)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._values.pop(key, None)
+            self._lists.pop(key, None)
+
+    async def push(self, key: str, *values: str):
+        self._lists.setdefault(key, []).extend(values)
+
+    async def pop(self, key: str, count: int = 100) -> list:
+        items = self._lists.get(key, [])
+        taken, self._lists[key] = items[:count], items[count:]
+        return taken
+
+    async def ping(self):
+        return True
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    """Тот же интерфейс поверх протокола Redis (RESP2) на asyncio-потоках, без сторонних пакетов.
+
+    Соединения берутся из небольшого пула; при ошибке соединение закрывается,
+    а вызывающий получает StateError и решает сам (как правило — работает по локальным данным).
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, db: int = 0, password: str = None,
+                 max_connections: int = 16, timeout: float = 2.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(max_connections)
+        self._idle = []
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs):
+        parts = urlsplit(url)
+        db = int(parts.path.lstrip("/") or 0)
+        return cls(parts.hostname or "127.0.0.1", parts.port or 6379, db, parts.password, **kwargs)
+
+    # --- протокол ---
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(out)
+
+    @classmethod
+    async def _read_reply(cls, reader: asyncio.StreamReader):
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("соединение закрыто")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise StateError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            size = int(payload)
+            if size < 0:
+                return None
+            data = await reader.readexactly(size + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            size = int(payload)
+            return None if size < 0 else [await cls._read_reply(reader) for _ in range(size)]
+        raise StateError(f"неизвестный ответ: {line!r}")
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            writer.write(b"".join(self._encode(*cmd) for cmd in setup))
+            for _ in setup:
+                await self._read_reply(reader)
+        return reader, writer
+
+    async def _pipeline(self, commands: list) -> list:
+        with tracer.span("state", command=commands[0][0], count=len(commands)):
+            return await self._execute(commands)
+
+    async def _execute(self, commands: list) -> list:
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else None
+            try:
+                if conn is None:
+                    conn = await asyncio.wait_for(self._connect(), self.timeout)
+                reader, writer = conn
+                writer.write(b"".join(self._encode(*cmd) for cmd in commands))
+                await writer.drain()
+                replies = []
+                for _ in commands:
+                    try:
+                        replies.append(await asyncio.wait_for(self._read_reply(reader), self.timeout))
+                    except StateError as e:
+                        replies.append(e)  # ошибка команды — соединение остаётся рабочим
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                if conn is not None:
+                    conn[1].close()
+                raise StateError(f"Redis {self.host}:{self.port} недоступен: {e}") from e
+            except BaseException:
+                if conn is not None:
+                    conn[1].close()
+                raise
+            self._idle.append(conn)
+        for reply in replies:
+            if isinstance(reply, StateError):
+                raise reply
+        return replies
+
+    async def _command(self, *args):
+        return (await self._pipeline([args]))[0]
+
+    # --- интерфейс бэкенда ---
+
+    async def get(self, key: str):
+        return await self._command("GET", key)
+
+    async def set(self, key: str, value: str, ttl: float = None):
+        if ttl:
+            await self._command("SET", key, value, "PX", int(ttl * 1000))
+        else:
+            await self._command("SET", key, value)
+
+    async def set_many(self, items: dict, ttl: float = None):
+        if items:
+            extra = ("PX", int(ttl * 1000)) if ttl else ()
+            await self._pipeline([("SET", key, value, *extra) for key, value in items.items()])
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self._command("DEL", *keys)
+
+    async def push(self, key: str, *values: str):
+        if values:
+            await self._command("RPUSH", key, *values)
+
+    async def pop(self, key: str, count: int = 100) -> list:
+        return await self._command("LPOP", key, count) or []
+
+    async def ping(self):
+        return await self._command("PING") == "PONG"
+
+    async def close(self):
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+def create_backend(url: str):
+    """memory:// или redis://[:пароль@]хост:порт/бд; пустая строка — без общего состояния."""
+    if not url:
+        return None
+    scheme = urlsplit(url).scheme
+    if scheme == "memory":
+        return MemoryBackend()
+    if scheme == "redis":
+        return RedisBackend.from_url(url)
+    raise ValueError(f"Неизвестный бэкенд состояния: {url}")
+
+
+# Общий бэкенд процесса (сессии, кэши, очередь уведомлений админу); None — всё локально
+state_backend = create_backend(os.getenv("STATE_BACKEND", ""))
@@ -0,0 +1,27 @@
+from collections import defaultdict, deque
+
+
+class HandlerTimings:
+    """Замеры времени обработчиков: последние N значений на каждый хендлер."""
+
+    def __init__(self, window: int = 1000):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._counts = defaultdict(int)
+
+    def record(self, name: str, seconds: float):
+        self._samples[name].append(seconds)
+        self._counts[name] += 1
+
+    def summary(self) -> str:
+        if not self._samples:
+            return "Замеров пока нет."
+        lines = []
+        for name in sorted(self._samples):
+            values = sorted(self._samples[name])
+            avg = sum(values) / len(values)
+            p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+            lines.append(
+                f"{name}: n={self._counts[name]} avg={avg * 1000:.0f}мс "
+                f"p95={p95 * 1000:.0f}мс max={values[-1] * 1000:.0f}мс"
+            )
+        return "\n".join(lines)
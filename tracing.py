@@ -0,0 +1,195 @@
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import secrets
+import sys
+import time
+from contextlib import contextmanager
+
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+_span_ids = itertools.count(1)
+
+# Атрибуты LogRecord, которые не попадают в JSON как дополнительные поля
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, логгер, сообщение и поля из extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Кладёт запись в очередь без блокировки; при переполнении запись отбрасывается и считается.
+
+    trace_id проставляется здесь, в контексте вызывающего кода, а не в потоке записи.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        trace = _trace.get()
+        if trace is not None and "trace_id" not in record.__dict__:
+            record.trace_id = trace.id
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+
+
+def setup_logging(level: str = "INFO", path: str = "", queue_size: int = 10_000):
+    """Логи уходят в очередь, а пишет их отдельный поток (QueueListener): event loop не ждёт диск/stdout.
+
+    path — файл для JSON-строк; пусто — stdout. Повторный вызов ничего не делает.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    target = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler(sys.stdout)
+    target.setFormatter(JsonFormatter())
+    log_queue = queue.Queue(queue_size)
+    _listener = logging.handlers.QueueListener(log_queue, target, respect_handler_level=False)
+    root = logging.getLogger()
+    root.handlers[:] = [_QueueHandler(log_queue)]
+    root.setLevel(level.upper())
+    # httpx пишет INFO на каждый запрос к Bot API — это покрывают спаны
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+class Trace:
+    __slots__ = ("id", "sampled", "spans", "error", "attrs")
+
+    def __init__(self, sampled: bool, attrs: dict):
+        self.id = secrets.token_hex(8)
+        self.sampled = sampled
+        self.spans = []
+        self.error = False
+        self.attrs = attrs
+
+
+class Tracer:
+    """Трассировка апдейтов: корневой спан на апдейт и дочерние на каждый внешний вызов.
+
+    Спаны копятся в памяти и пишутся в лог при завершении апдейта, если апдейт попал
+    в выборку (sample_rate), упал или шёл дольше slow_ms. Спаны вне апдейта
+    (фоновая запись в Sheets, рассылки) проходят тот же отбор поодиночке.
+    """
+
+    MAX_SPANS = 200
+
+    def __init__(self, sample_rate: float = 0.05, slow_ms: float = 1000.0):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.log = logging.getLogger("trace")
+
+    def current_id(self):
+        trace = _trace.get()
+        return trace.id if trace is not None else None
+
+    def annotate(self, **attrs):
+        """Дополняет корневой спан текущего апдейта (например, именем хендлера)."""
+        trace = _trace.get()
+        if trace is not None:
+            trace.attrs.update(attrs)
+
+    def _keep(self, sampled: bool, error: bool, duration_ms: float) -> bool:
+        return sampled or error or duration_ms >= self.slow_ms
+
+    def _emit(self, trace_id: str, record: dict):
+        level = logging.WARNING if record.get("error") else logging.INFO
+        self.log.log(level, record["span"], extra={"trace_id": trace_id, **record})
+
+    @contextmanager
+    def trace(self, name: str, **attrs):
+        """Корневой спан апдейта; внутри блока attrs можно дополнять."""
+        trace = Trace(random.random() < self.sample_rate, attrs)
+        trace_token = _trace.set(trace)
+        span_token = _span.set(0)
+        started = time.perf_counter()
+        error = None
+        try:
+            yield attrs
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            _span.reset(span_token)
+            _trace.reset(trace_token)
+            if self._keep(trace.sampled, trace.error or error is not None, duration_ms):
+                for record in trace.spans:
+                    self._emit(trace.id, record)
+                root = {"span": name, "span_id": 0, "duration_ms": round(duration_ms, 2), **trace.attrs}
+                if error:
+                    root["error"] = error
+                if len(trace.spans) >= self.MAX_SPANS:
+                    root["spans_truncated"] = True
+                self._emit(trace.id, root)
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Дочерний спан внешнего вызова (Bot API, Sheets, диск). attrs можно дополнять внутри блока."""
+        trace = _trace.get()
+        span_id = next(_span_ids)
+        parent_id = _span.get()
+        token = _span.set(span_id)
+        started = time.perf_counter()
+        error = None
+        try:
+            yield attrs
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            _span.reset(token)
+            record = {"span": name, "span_id": span_id, "parent_id": parent_id,
+                      "duration_ms": round(duration_ms, 2), **attrs}
+            if error:
+                record["error"] = error
+            if trace is not None:
+                trace.error = trace.error or error is not None
+                if len(trace.spans) < self.MAX_SPANS:
+                    trace.spans.append(record)
+            elif self._keep(random.random() < self.sample_rate, error is not None, duration_ms):
+                self._emit(None, record)
+
+
+tracer = Tracer(
+    sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0.05")),
+    slow_ms=float(os.getenv("TRACE_SLOW_MS", "1000")),
+)
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+import os
+from functools import partial
+
+from telegram import Bot, InputFile, Message
+from telegram.error import BadRequest
+
+from file_cache import FileIdCache, file_id_cache
+from rate_limit import BULK
+from state import StateError, state_backend
+from tracing import tracer
+
+log = logging.getLogger(__name__)
+
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # лимит Bot API на загрузку документа
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class UploadPool:
+    """Отправка файлов без блокировки event loop.
+
+    Повторные отправки идут по file_id из кэша и слот не занимают. Настоящие загрузки
+    ограничены max_uploads одновременно (отдельно от обычных ответов), файл читается
+    в потоке. Если этот же файл уже загружается для другого пользователя, ждём её
+    и отправляем по полученному file_id вместо второй загрузки.
+    С общим бэкендом file_id, полученные другими воркерами, тоже используются.
+    """
+
+    KEY = "file_id:{}"
+
+    def __init__(self, cache: FileIdCache, max_uploads: int = 4, max_size: int = MAX_UPLOAD_SIZE, backend=None):
+        self.cache = cache
+        self.backend = backend
+        self.max_size = max_size
+        self._slots = asyncio.Semaphore(max_uploads)
+        self._inflight = {}  # путь -> Future[file_id | None]
+        self.uploads = 0
+        self.shared = 0
+
+    def is_cached(self, filepath: str) -> bool:
+        return self.cache.get(filepath) is not None
+
+    async def file_id(self, filepath: str):
+        """file_id уже загруженного файла (свой кэш, затем общий бэкенд); None — файл ещё не загружали."""
+        file_id = self.cache.get(filepath)
+        if file_id is None and self.backend is not None:
+            file_id = await self._shared(filepath)
+        return file_id
+
+    async def reply(self, message: Message, filepath: str, filename: str, size: int = None, **kwargs):
+        return await self._deliver(message.reply_document, filepath, filename, size, **kwargs)
+
+    async def send(self, bot: Bot, chat_id, filepath: str, filename: str, size: int = None, **kwargs):
+        return await self._deliver(partial(bot.send_document, chat_id=chat_id), filepath, filename, size, **kwargs)
+
+    async def _deliver(self, send_document, filepath: str, filename: str, size: int = None, **kwargs):
+        if size is not None and size > self.max_size:
+            raise FileTooLarge(filepath)
+
+        file_id = await self.file_id(filepath)
+        if file_id is None and filepath in self._inflight:
+            file_id = await asyncio.shield(self._inflight[filepath])
+            if file_id:
+                self.shared += 1
+        if file_id:
+            try:
+                return await send_document(document=file_id, **kwargs)
+            except BadRequest as e:
+                log.info("file_id не принят, загружаем файл заново", extra={"path": filepath, "error": str(e)})
+                self.cache.drop(filepath)
+                await self._unshare(filepath)
+        return await self._upload(send_document, filepath, filename, **kwargs)
+
+    async def _upload(self, send_document, filepath: str, filename: str, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[filepath] = future
+        file_id = None
+        try:
+            async with self._slots:
+                with tracer.span("file.read", path=filepath) as span:
+                    data = await asyncio.to_thread(read_file, filepath)
+                    span["bytes"] = len(data)
+                if len(data) > self.max_size:
+                    raise FileTooLarge(filepath)
+                sent = await send_document(document=InputFile(data, filename=filename), **kwargs)
+            file_id = sent.document.file_id
+            self.cache.put(filepath, file_id)
+            await self._share(filepath, file_id)
+            self.uploads += 1
+            return sent
+        finally:
+            # ждущие получат file_id, а при ошибке (None) загрузят сами
+            future.set_result(file_id)
+            self._inflight.pop(filepath, None)
+
+    async def _shared(self, filepath: str):
+        """file_id из общего бэкенда, если он снят с того же варианта файла (размер и mtime)."""
+        try:
+            raw = await self.backend.get(self.KEY.format(filepath))
+        except StateError as e:
+            log.warning("Общий кэш file_id недоступен", extra={"error": str(e)})
+            return None
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        try:
+            if entry["sig"] != self.cache.signature(filepath):
+                return None
+        except OSError:
+            return None
+        self.cache.put(filepath, entry["file_id"])
+        return entry["file_id"]
+
+    async def _share(self, filepath: str, file_id: str):
+        if self.backend is None:
+            return
+        try:
+            entry = {"sig": self.cache.signature(filepath), "file_id": file_id}
+            await self.backend.set(self.KEY.format(filepath), json.dumps(entry))
+        except (OSError, StateError) as e:
+            log.warning("Не удалось сохранить file_id в общий кэш", extra={"path": filepath, "error": str(e)})
+
+    async def _unshare(self, filepath: str):
+        if self.backend is None:
+            return
+        try:
+            await self.backend.delete(self.KEY.format(filepath))
+        except StateError:
+            pass
+
+    async def prewarm(self, bot: Bot, chat_id, files):
+        """Загружает в служебный чат все файлы, для которых ещё нет file_id.
+
+        files — список пар (название, путь). Вызывается один раз при старте.
+        """
+        uploaded = 0
+        for filename, filepath in files:
+            if self.is_cached(filepath) or not os.path.isfile(filepath):
+                continue
+            try:
+                await self.send(bot, chat_id, filepath, filename, os.path.getsize(filepath),
+                                disable_notification=True, rate_limit_args={"priority": BULK})
+                uploaded += 1
+            except Exception as e:
+                log.warning("Ошибка прогрева файла", extra={"path": filepath, "error": str(e)})
+        log.info("Прогрев файлов завершён", extra={"uploaded": uploaded})
+
+
+# Общий пул для bot.py и materials.py
+upload_pool = UploadPool(file_id_cache, max_uploads=int(os.getenv("MAX_CONCURRENT_UPLOADS", "4")),
+                         backend=state_backend)
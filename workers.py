@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+
+import httpx
+
+log = logging.getLogger(__name__)
+
+
+def update_user_id(payload: dict):
+    """id пользователя из сырого апдейта: поле from любого вложенного объекта (message, callback_query, ...)."""
+    for value in payload.values():
+        if isinstance(value, dict):
+            sender = value.get("from")
+            if isinstance(sender, dict) and "id" in sender:
+                return sender["id"]
+    return None
+
+
+def worker_for(user_id, count: int) -> int:
+    """Один и тот же пользователь всегда попадает в один воркер; апдейты без пользователя — в нулевой."""
+    return 0 if user_id is None else user_id % count
+
+
+class UpdateRouter:
+    """Принимает вебхук Telegram и пересылает апдейт воркеру по id пользователя.
+
+    Ответ воркера возвращается Telegram как есть: если воркер недоступен, Telegram
+    получит ошибку и повторит доставку позже.
+    """
+
+    def __init__(self, targets: list, secret: str = "", timeout: float = 10.0):
+        self.targets = targets
+        self.secret = secret
+        self.forwarded = [0] * len(targets)
+        self._client = httpx.AsyncClient(timeout=timeout)
+
+    async def handle(self, request):
+        if self.secret and request.headers.get("x-telegram-bot-api-secret-token") != self.secret:
+            return 403, "Forbidden"
+        try:
+            payload = json.loads(request.body)
+        except ValueError:
+            return 400, "Bad Request"
+        index = worker_for(update_user_id(payload), len(self.targets))
+        headers = {"content-type": "application/json"}
+        if self.secret:
+            headers["x-telegram-bot-api-secret-token"] = self.secret
+        try:
+            response = await self._client.post(self.targets[index], content=request.body, headers=headers)
+        except httpx.HTTPError as e:
+            log.warning("Воркер недоступен", extra={"worker": index, "error": str(e)})
+            return 503, "Service Unavailable"
+        self.forwarded[index] += 1
+        return response.status_code, response.text
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def spawn_workers(script: str, envs: list) -> list:
+    """Запускает воркеры тем же интерпретатором; envs — дополнительные переменные окружения каждого."""
+    processes = []
+    for extra in envs:
+        env = dict(os.environ, **extra)
+        processes.append(subprocess.Popen([sys.executable, script], env=env))
+    return processes
+
+
+def stop_workers(processes: list, timeout: float = 30.0):
+    """SIGTERM всем и ждём штатного завершения (воркеры дописывают очереди), затем добиваем."""
+    for process in processes:
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+    for process in processes:
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()